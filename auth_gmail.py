@@ -21,7 +21,8 @@ async def main():
             client_id=config.gmail_client_id,
             client_secret=config.gmail_client_secret,
             token_file=config.gmail_token_file,
-            scopes=config.gmail_scopes
+            scopes=config.gmail_scopes,
+            account=config.gmail_account
         )
 
         # Authenticate
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Gmail Replay Benchmark for Gmail Verification Bot
+Times get_recent_messages against recorded Gmail API responses, through
+the real googleapiclient request path, without a Gmail account.
+
+Use a recording made by the bot with GMAIL_RECORD_FILE, or synthesize one
+with --synthesize. Recordings are matched by exact request, so keywords
+and max results must be the same as when recording.
+
+Usage:
+    python benchmarks/gmail_replay_benchmark.py --synthesize 50
+        [--file gmail.jsonl.gz] [--polls 20] [--latency-ms 50]
+    python benchmarks/gmail_replay_benchmark.py --file gmail.jsonl.gz
+        [--keywords verification,code] [--max-results 10]
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_DIR))
+
+from gmail_recording import RecordingHttp  # noqa: E402
+from gmail_service import GmailService  # noqa: E402
+from offline_replay import DEFAULT_KEYWORDS  # noqa: E402
+
+
+class SyntheticHttp:
+    """Answer Gmail list/get requests with generated messages"""
+
+    def __init__(self, count: int, html_kb: int):
+        self.count = count
+        self.html = '<p>Hello</p>' * (html_kb * 1024 // 12)
+        self.date = format_datetime(datetime.now(timezone.utc))
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        import httplib2
+
+        parts = urlsplit(uri)
+        query = parse_qs(parts.query)
+        if parts.path.endswith('/messages'):
+            start = int(query.get('pageToken', ['0'])[0])
+            end = min(start + int(query['maxResults'][0]), self.count)
+            result = {'messages': [
+                {'id': f'{i:016x}', 'threadId': f'{i:016x}'}
+                for i in range(start, end)
+            ]}
+            if end < self.count:
+                result['nextPageToken'] = str(end)
+        else:
+            result = self._message(parts.path.rsplit('/', 1)[-1])
+
+        resp = httplib2.Response({
+            'status': '200', 'content-type': 'application/json; charset=UTF-8'
+        })
+        return resp, json.dumps(result).encode()
+
+    def _message(self, message_id: str) -> dict:
+        code = f'{int(message_id, 16) % 900000 + 100000}'
+        html = f'{self.html}<b>Your verification code is {code}</b>'
+        return {
+            'id': message_id,
+            'payload': {
+                'mimeType': 'multipart/alternative',
+                'headers': [
+                    {'name': 'Subject', 'value': f'Verification code {code}'},
+                    {'name': 'From', 'value': 'noreply@example.com'},
+                    {'name': 'Date', 'value': self.date},
+                ],
+                'body': {'size': 0},
+                'parts': [{
+                    'mimeType': 'text/html',
+                    'body': {'data': base64.urlsafe_b64encode(
+                        html.encode()
+                    ).decode()},
+                }],
+            },
+        }
+
+    def close(self):
+        pass
+
+
+def make_gmail(args, **kwargs) -> GmailService:
+    """GmailService configured like the bot, without credentials"""
+    return GmailService(
+        'benchmark', 'benchmark', os.devnull, [],
+        quota_units_per_second=args.quota,
+        max_results=args.max_results,
+        **kwargs
+    )
+
+
+async def synthesize(args, keywords):
+    """Record one poll against synthetic Gmail responses"""
+    from googleapiclient.discovery import build
+
+    gmail = make_gmail(args)
+    gmail.service = build('gmail', 'v1', http=RecordingHttp(
+        SyntheticHttp(args.synthesize, args.html_kb), args.file
+    ))
+    messages = await gmail.get_recent_messages(keywords)
+    gmail.close()
+    print(f"Synthesized {len(messages)} messages into {args.file} "
+          f"({os.path.getsize(args.file) / 1024:.0f} KB)")
+
+
+async def benchmark(args, keywords):
+    """Time polls against the recording"""
+    gmail = make_gmail(
+        args, replay_file=args.file, replay_latency=args.latency_ms / 1000
+    )
+    if not await gmail.authenticate():
+        sys.exit("Failed to load the recording")
+
+    timings, found = [], []
+    for _ in range(args.polls):
+        # Recorded messages are old: treat all of them as new on every poll,
+        # and forget which ones earlier polls already handled
+        gmail.last_check_time = datetime.min.replace(tzinfo=timezone.utc)
+        gmail.seen_ids.clear()
+        gmail.state_version = 0
+        start = time.perf_counter()
+        messages = await gmail.get_recent_messages(keywords)
+        timings.append(time.perf_counter() - start)
+        found.append(len(messages))
+
+    replay_http = gmail.service._http
+    gmail.close()
+    if replay_http.misses:
+        print(f"⚠️ {replay_http.misses} requests were not in the recording "
+              f"(check --keywords and --max-results)")
+
+    print(f"Polls: {args.polls}, messages per poll: {statistics.mean(found):.0f}, "
+          f"simulated latency: {args.latency_ms} ms per request")
+    print(f"Poll time: mean {statistics.mean(timings) * 1000:.1f} ms, "
+          f"median {statistics.median(timings) * 1000:.1f} ms, "
+          f"min {min(timings) * 1000:.1f} ms, "
+          f"max {max(timings) * 1000:.1f} ms")
+    total = sum(timings)
+    print(f"Throughput: {sum(found) / total:.0f} messages/s, "
+          f"{replay_http.requests / total:.0f} API requests/s")
+    print(f"Quota throttling: {gmail.quota.throttled_seconds:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--file', help='recording to replay (or write with --synthesize)')
+    parser.add_argument('--synthesize', type=int, metavar='N',
+                        help='first record a poll of N synthetic messages')
+    parser.add_argument('--html-kb', type=int, default=20,
+                        help='HTML body size of synthetic messages in KB')
+    parser.add_argument('--polls', type=int, default=20)
+    parser.add_argument('--latency-ms', type=int, default=0,
+                        help='simulated latency per API request')
+    parser.add_argument('--keywords', default=DEFAULT_KEYWORDS)
+    parser.add_argument('--max-results', type=int, default=10)
+    parser.add_argument('--quota', type=float, default=200,
+                        help='Gmail quota units per second (bot default: 200)')
+    args = parser.parse_args()
+
+    if not args.file and not args.synthesize:
+        parser.error('--file or --synthesize is required')
+    if args.synthesize:
+        args.max_results = max(args.max_results, args.synthesize)
+        if not args.file:
+            args.file = os.path.join(tempfile.mkdtemp(), 'gmail.jsonl.gz')
+        elif os.path.exists(args.file):
+            os.remove(args.file)
+
+    keywords = [keyword.strip() for keyword in args.keywords.split(',')]
+    if args.synthesize:
+        asyncio.run(synthesize(args, keywords))
+    asyncio.run(benchmark(args, keywords))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+Fan-out Load Test for Gmail Verification Bot
+Delivers verification emails arriving at a steady rate to many chats and
+reports how long each chat waits for its codes.
+
+Gmail is replaced by a fake backend that receives a new email every
+1/rate seconds, and Telegram by a local fake Bot API server with
+configurable latency and an optional global rate limit answered with 429.
+The bot's own check_gmail runs every check interval with its own check
+cursor and seen IDs, so latency covers the whole path: waiting for the
+next check, fetching, extracting and fanning out through the chosen
+sender. The run exits with status 1 if any chat misses any email.
+
+Senders:
+    serial     TelegramService delivering each message to chat after chat
+    coalesced  TelegramService with MESSAGE_COALESCING on
+    module:Class  a TelegramService subclass (same constructor), e.g.
+                  my_sender:ConcurrentTelegramService
+
+Usage:
+    python benchmarks/load_test.py [--chats 20] [--emails 10] [--rate 1]
+        [--sender serial] [--api-latency-ms 30] [--api-rate-limit 30]
+        [--check-interval 1] [--per-chat] [--json results.json]
+"""
+
+import argparse
+import asyncio
+import base64
+import importlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from pathlib import Path
+from typing import Dict, List
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_DIR))
+
+TOKEN = '123456:LOADTESTloadtestLOADTESTloadtest0000'
+CODE_PATTERN = re.compile(r'\b\d{6}\b')
+# Email i carries code FIRST_CODE + i, so delivered texts map back to emails
+FIRST_CODE = 100000
+
+
+class FakeRequest:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        return self.result()
+
+
+class FakeGmail:
+    """Gmail messages list/get backed by emails generated at a fixed rate"""
+
+    def __init__(self):
+        # Arrival times (monotonic) of the emails received so far
+        self.arrivals: List[float] = []
+        self.dates: List[str] = []
+        # Indexes of the emails the bot has fetched at least once
+        self.fetched = set()
+
+    def receive(self):
+        """A new verification email arrives"""
+        self.arrivals.append(time.monotonic())
+        self.dates.append(format_datetime(datetime.now(timezone.utc)))
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def list(self, userId, q, maxResults, pageToken=None):
+        # Newest first, like Gmail
+        start = int(pageToken or 0)
+        ids = [f'{i:08d}' for i in reversed(range(len(self.arrivals)))]
+        page = {'messages': [{'id': i} for i in ids[start:start + maxResults]]}
+        if start + maxResults < len(ids):
+            page['nextPageToken'] = str(start + maxResults)
+        return FakeRequest(lambda: page)
+
+    def get(self, userId, id, format):
+        self.fetched.add(int(id))
+        return FakeRequest(lambda: self._message(int(id)))
+
+    def _message(self, index: int) -> Dict:
+        code = FIRST_CODE + index
+        body = f'Your verification code is {code}'.encode()
+        return {
+            'id': f'{index:08d}',
+            'payload': {
+                'mimeType': 'text/plain',
+                'headers': [
+                    {'name': 'Subject', 'value': f'Verification code {code}'},
+                    {'name': 'From', 'value': f'sender{index}@example.com'},
+                    {'name': 'Date', 'value': self.dates[index]},
+                ],
+                'body': {'data': base64.urlsafe_b64encode(body).decode()},
+            },
+        }
+
+    def close(self):
+        pass
+
+
+class FakeBotAPI:
+    """Local Bot API server recording when each chat receives each code"""
+
+    def __init__(self, latency: float, rate_limit: float):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        # (chat_id, code) -> monotonic time of first delivery
+        self.deliveries: Dict[tuple, float] = {}
+        self.calls = 0
+        self.rate_limited = 0
+        self._message_id = 0
+        self._window_start = 0.0
+        self._window_calls = 0
+        self._runner = None
+        self.url = None
+
+    async def start(self):
+        """Serve on a free local port"""
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}'
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    def _over_rate_limit(self) -> bool:
+        """Count a call against a one-second window, like Telegram's limit"""
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        if now - self._window_start >= 1:
+            self._window_start, self._window_calls = now, 0
+        self._window_calls += 1
+        return self._window_calls > self.rate_limit
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        method = request.match_info['method'].lower()
+        data = await request.post()
+        self.calls += 1
+        if self.latency:
+            # Round trips vary; keep the mean at the configured latency
+            await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+
+        if method == 'getme':
+            return web.json_response({'ok': True, 'result': {
+                'id': 123456, 'is_bot': True, 'first_name': 'Load Test',
+                'username': 'load_test_bot',
+            }})
+        if method not in ('sendmessage', 'editmessagetext'):
+            return web.json_response({'ok': True, 'result': True})
+
+        if self._over_rate_limit():
+            self.rate_limited += 1
+            return web.json_response({
+                'ok': False, 'error_code': 429,
+                'description': 'Too Many Requests: retry after 1',
+                'parameters': {'retry_after': 1},
+            }, status=429)
+
+        now = time.monotonic()
+        chat_id, text = data['chat_id'], data['text']
+        for code in CODE_PATTERN.findall(text):
+            self.deliveries.setdefault((chat_id, int(code)), now)
+
+        self._message_id += 1
+        return web.json_response({'ok': True, 'result': {
+            'message_id': int(data.get('message_id', self._message_id)),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private'},
+            'text': text,
+        }})
+
+
+def configure_env(args, chat_ids: List[str]):
+    """Bot configuration for the test, set before config.py is imported"""
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': TOKEN,
+        'TELEGRAM_CHAT_IDS': ','.join(chat_ids),
+        'TELEGRAM_ADMIN_IDS': '1',
+        'GMAIL_CLIENT_ID': 'load-test',
+        'GMAIL_CLIENT_SECRET': 'load-test',
+        'GMAIL_MAX_RESULTS': str(args.max_results),
+        'CHECK_INTERVAL': str(args.check_interval),
+        'MESSAGE_COALESCING': str(args.sender == 'coalesced').lower(),
+        'COALESCE_WINDOW': '0',
+        'CODE_EDIT_WINDOW': '0',
+        'TELEGRAM_MESSAGE_FORMAT': 'HTML',
+        'TELEGRAM_CHAT_FORMATS': '',
+        'TELEGRAM_WEBHOOK_URL': '',
+        'PROFILE_SAMPLE_RATE': '0',
+        'HTTP_PORT': '0',
+        'CONFIG_RELOAD_INTERVAL': '0',
+        'STATE_FILE': '',
+        'LOG_LEVEL': args.log_level,
+    })
+
+
+def load_sender(spec: str):
+    """Resolve --sender to a TelegramService class"""
+    if spec in ('serial', 'coalesced'):
+        from telegram_service import TelegramService
+        return TelegramService
+    module_name, _, class_name = spec.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+async def generate(gmail: FakeGmail, emails: int, rate: float):
+    """Deliver emails to the fake mailbox on a fixed schedule"""
+    start = time.monotonic()
+    for i in range(emails):
+        await asyncio.sleep(max(0.0, start + i / rate - time.monotonic()))
+        gmail.receive()
+
+
+async def run(args, chat_ids: List[str]):
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    import main
+
+    api = FakeBotAPI(args.api_latency_ms / 1000, args.api_rate_limit)
+    await api.start()
+
+    bot = main.GmailVerificationBot()
+    sender = load_sender(args.sender)(bot.config, stats=bot.stats)
+    sender.bot = Bot(TOKEN, session=AiohttpSession(
+        api=TelegramAPIServer.from_base(api.url)
+    ))
+    sender.is_ready = True
+    bot.telegram_service = sender
+    bot.gmail_service.telegram_service = sender
+    gmail = FakeGmail()
+    bot.gmail_service.service = gmail
+
+    expected = args.emails * len(chat_ids)
+    start = time.monotonic()
+    generator = asyncio.create_task(generate(gmail, args.emails, args.rate))
+    deadline = start + args.emails / args.rate + args.drain_timeout
+    checks = 0
+    while time.monotonic() < deadline:
+        await bot.check_gmail()
+        checks += 1
+        if generator.done() and len(api.deliveries) >= expected:
+            break
+        await asyncio.sleep(args.check_interval)
+    elapsed = time.monotonic() - start
+
+    generator.cancel()
+    await sender.bot.session.close()
+    await api.stop()
+    return api, gmail, checks, elapsed
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    index = max(0, min(len(values) - 1, round(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+def _summary(values: List[float]) -> str:
+    """p50/p95/p99/max of latencies in seconds"""
+    if not values:
+        return 'no deliveries'
+    values = sorted(values)
+    return (f"p50 {_percentile(values, 50):.2f}s, "
+            f"p95 {_percentile(values, 95):.2f}s, "
+            f"p99 {_percentile(values, 99):.2f}s, max {values[-1]:.2f}s")
+
+
+def _chat_row(label: str, latencies: List[float], expected: int) -> str:
+    """One row of the per-chat latency table"""
+    if not latencies:
+        return f"{label:>12} {'-':>8} {'-':>8} {'-':>8} {0:>6}/{expected}"
+    latencies = sorted(latencies)
+    return (f"{label:>12} {_percentile(latencies, 50):>8.2f} "
+            f"{_percentile(latencies, 95):>8.2f} {latencies[-1]:>8.2f} "
+            f"{len(latencies):>6}/{expected}")
+
+
+def report(args, chat_ids: List[str], api: FakeBotAPI, gmail: FakeGmail,
+           checks: int, elapsed: float) -> bool:
+    """Print delivery latency overall, per email and per chat.
+
+    Returns whether every chat received every email.
+    """
+    per_chat: Dict[str, List[float]] = {chat_id: [] for chat_id in chat_ids}
+    per_email: Dict[int, List[float]] = {}
+    for (chat_id, code), delivered in api.deliveries.items():
+        index = code - FIRST_CODE
+        if chat_id not in per_chat or not 0 <= index < len(gmail.arrivals):
+            continue
+        per_chat[chat_id].append(delivered - gmail.arrivals[index])
+        per_email.setdefault(index, []).append(delivered)
+
+    delivered = sum(map(len, per_chat.values()))
+    expected = args.emails * len(chat_ids)
+    print(f"{args.emails} emails at {args.rate:g}/s to {len(chat_ids)} chats, "
+          f"sender {args.sender}, API latency {args.api_latency_ms} ms"
+          f"{f', rate limit {args.api_rate_limit:g}/s' if args.api_rate_limit else ''}")
+    print(f"Delivered {delivered}/{expected} ({delivered / expected:.1%}) in "
+          f"{elapsed:.1f}s over {checks} checks; {api.calls} API calls, "
+          f"{api.rate_limited} rate limited")
+    if delivered < expected:
+        unlisted = args.emails - len(gmail.fetched)
+        dropped = len(gmail.fetched) - len(per_email)
+        print(f"⚠️ {expected - delivered} deliveries missing:")
+        if unlisted:
+            print(f"   {unlisted} emails never fetched, more arrived between "
+                  f"checks than --max-results lists")
+        if dropped:
+            print(f"   {dropped} emails fetched but sent to no chat")
+        if api.rate_limited:
+            print(f"   {api.rate_limited} sends answered with 429")
+
+    print(f"\nLatency, email arrival to chat: "
+          f"{_summary([x for values in per_chat.values() for x in values])}")
+    print(f"Fan-out, first to last chat per email: "
+          f"{_summary([max(times) - min(times) for times in per_email.values()])}")
+
+    print(f"\n{'chats':>12} {'p50 s':>8} {'p95 s':>8} {'max s':>8} "
+          f"{'delivered':>13}")
+    if args.per_chat:
+        for chat_id in chat_ids:
+            print(_chat_row(chat_id, per_chat[chat_id], args.emails))
+    else:
+        # Chats in TELEGRAM_CHAT_IDS order, in up to ten groups
+        group = max(1, -(-len(chat_ids) // 10))
+        for first in range(0, len(chat_ids), group):
+            ids = chat_ids[first:first + group]
+            print(_chat_row(
+                f'{first + 1}-{first + len(ids)}',
+                [x for chat_id in ids for x in per_chat[chat_id]],
+                args.emails * len(ids)
+            ))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'args': vars(args),
+                'elapsed': elapsed,
+                'api_calls': api.calls,
+                'rate_limited': api.rate_limited,
+                'chats': {
+                    chat_id: sorted(latencies)
+                    for chat_id, latencies in per_chat.items()
+                },
+            }, f, indent=2)
+        print(f"\nPer-chat latencies written to {args.json}")
+
+    return delivered == expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--chats', type=int, default=20)
+    parser.add_argument('--emails', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=1.0,
+                        help='emails arriving per second')
+    parser.add_argument('--sender', default='serial',
+                        help='serial, coalesced or module:Class')
+    parser.add_argument('--api-latency-ms', type=int, default=30,
+                        help='mean Bot API response time')
+    parser.add_argument('--api-rate-limit', type=float, default=0,
+                        help='messages per second before 429s (0 = unlimited)')
+    parser.add_argument('--check-interval', type=int, default=1,
+                        help='seconds between Gmail checks (CHECK_INTERVAL)')
+    parser.add_argument('--max-results', type=int, default=10,
+                        help='emails listed per check (GMAIL_MAX_RESULTS)')
+    parser.add_argument('--drain-timeout', type=float, default=300,
+                        help='seconds to wait for deliveries after the last email')
+    parser.add_argument('--per-chat', action='store_true',
+                        help='one table row per chat instead of groups')
+    parser.add_argument('--json', help='write per-chat latencies to a file')
+    parser.add_argument('--log-level', default='CRITICAL',
+                        help='bot log level (default: CRITICAL)')
+    args = parser.parse_args()
+
+    chat_ids = [str(1000 + i) for i in range(args.chats)]
+    configure_env(args, chat_ids)
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    # main.py opens bot.log in the working directory
+    os.chdir(tempfile.mkdtemp())
+
+    api, gmail, checks, elapsed = asyncio.run(run(args, chat_ids))
+    if not report(args, chat_ids, api, gmail, checks, elapsed):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
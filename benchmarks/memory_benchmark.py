@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Memory Benchmark for Gmail Verification Bot
+Measures peak RSS while a burst of verification emails goes through the
+fetch → decode → extract → format → deliver pipeline.
+
+Gmail is replaced by a fake service that generates large multipart
+messages on demand, and delivery by a sleep of the given latency, so the
+numbers reflect how many messages the bot holds at once, not the network.
+Each burst size runs in a fresh process so peaks don't carry over.
+
+Usage:
+    python benchmarks/memory_benchmark.py [--bursts 10,100,1000]
+        [--html-kb 200] [--queue-size 4] [--delivery-latency 0.001]
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+BURST_SNIPPET = """
+import asyncio
+import base64
+import json
+import resource
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from gmail_service import GmailService
+from message_formats import FORMATS
+from message_formatter import MessageFormatter
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class FakeRequest:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        return self.result()
+
+
+class FakeMessages:
+    def __init__(self, burst, html_kb):
+        self.burst = burst
+        self.html = ('<p>Hello</p>' * (html_kb * 1024 // 12)).encode()
+        self.date = format_datetime(datetime.now(timezone.utc))
+
+    def list(self, userId, q, maxResults, pageToken=None):
+        start = int(pageToken or 0)
+        end = min(start + maxResults, self.burst)
+        page = {{'messages': [{{'id': str(i)}} for i in range(start, end)]}}
+        if end < self.burst:
+            page['nextPageToken'] = str(end)
+        return FakeRequest(lambda: page)
+
+    def get(self, userId, id, format):
+        # Build the payload on demand, like a response coming off the wire
+        return FakeRequest(lambda: self._message(id))
+
+    def _message(self, message_id):
+        code = f'{{int(message_id) % 900000 + 100000}}'
+        plain = f'Your verification code is {{code}}'.encode()
+        return {{
+            'id': message_id,
+            'payload': {{
+                'mimeType': 'multipart/alternative',
+                'headers': [
+                    {{'name': 'Subject', 'value': f'Verification code {{code}}'}},
+                    {{'name': 'From', 'value': 'noreply@example.com'}},
+                    {{'name': 'Date', 'value': self.date}},
+                ],
+                'body': {{}},
+                'parts': [
+                    {{'mimeType': 'text/plain', 'body': {{
+                        'data': base64.urlsafe_b64encode(plain).decode()
+                    }}}},
+                    {{'mimeType': 'text/html', 'body': {{
+                        'data': base64.urlsafe_b64encode(
+                            self.html + plain
+                        ).decode()
+                    }}}},
+                ],
+            }},
+        }}
+
+
+class FakeUsers:
+    def __init__(self, messages):
+        self._messages = messages
+
+    def messages(self):
+        return self._messages
+
+
+class FakeService:
+    def __init__(self, burst, html_kb):
+        self._users = FakeUsers(FakeMessages(burst, html_kb))
+
+    def users(self):
+        return self._users
+
+
+async def run():
+    gmail = GmailService(
+        'benchmark', 'benchmark', '/nonexistent/token.json', [],
+        quota_units_per_second=10 ** 9,
+        max_results={burst},
+        pipeline_queue_size={queue_size}
+    )
+    gmail.service = FakeService({burst}, {html_kb})
+    formatter = MessageFormatter()
+    delivered = 0
+
+    def render(msg):
+        return formatter.render_variants(msg, FORMATS)
+
+    async def deliver(msg, rendered):
+        nonlocal delivered
+        await asyncio.sleep({delivery_latency})
+        delivered += 1
+
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    messages = await gmail.get_recent_messages(
+        ['verification'], render=render, deliver=deliver
+    )
+    elapsed = time.perf_counter() - start
+    assert len(messages) == delivered == {burst}, (len(messages), delivered)
+    print(json.dumps({{
+        'baseline_mb': baseline,
+        'peak_mb': peak_rss_mb(),
+        'seconds': elapsed,
+    }}))
+
+
+asyncio.run(run())
+"""
+
+
+def run_burst(burst: int, args) -> dict:
+    """Run one burst in a fresh interpreter and return its measurements"""
+    code = BURST_SNIPPET.format(
+        burst=burst,
+        html_kb=args.html_kb,
+        queue_size=args.queue_size,
+        delivery_latency=args.delivery_latency,
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        cwd=PROJECT_DIR, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--bursts', default='10,100,1000',
+                        help='comma-separated numbers of emails per burst')
+    parser.add_argument('--html-kb', type=int, default=200,
+                        help='size of each email HTML body in KB')
+    parser.add_argument('--queue-size', type=int, default=4,
+                        help='messages buffered between pipeline stages')
+    parser.add_argument('--delivery-latency', type=float, default=0.001,
+                        help='simulated Telegram delivery time per message')
+    args = parser.parse_args()
+
+    bursts = [int(burst) for burst in args.bursts.split(',')]
+    total_mb = max(bursts) * args.html_kb * 4 / 3 / 1024
+    print(
+        f"Emails of ~{args.html_kb} KB HTML (~{total_mb:.0f} MB base64 for "
+        f"the largest burst), queue size {args.queue_size}\n"
+    )
+    print(f"{'emails':>8} {'baseline MB':>12} {'peak MB':>9} "
+          f"{'growth MB':>10} {'emails/s':>9}")
+
+    for burst in bursts:
+        result = run_burst(burst, args)
+        growth = result['peak_mb'] - result['baseline_mb']
+        print(
+            f"{burst:>8} {result['baseline_mb']:>12.1f} "
+            f"{result['peak_mb']:>9.1f} {growth:>10.1f} "
+            f"{burst / result['seconds']:>9.0f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Startup Benchmark for Gmail Verification Bot
+Measures module import times and time-to-first-poll in fresh processes.
+
+Gmail authentication and Telegram setup are replaced with sleeps of the
+given latency so the numbers reflect startup orchestration, not the network.
+
+Usage:
+    python benchmarks/startup_benchmark.py [--runs 5]
+        [--auth-latency 0.5] [--telegram-latency 0.3]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+# Dummy configuration so config.py can be imported
+BENCH_ENV = {
+    'TELEGRAM_BOT_TOKEN': '123456:BENCHMARKbenchmarkBENCHMARKbenchmark00',
+    'TELEGRAM_CHAT_IDS': '1',
+    'TELEGRAM_ADMIN_IDS': '1',
+    'GMAIL_CLIENT_ID': 'benchmark',
+    'GMAIL_CLIENT_SECRET': 'benchmark',
+    'CHECK_INTERVAL': '0',
+    'CONFIG_RELOAD_INTERVAL': '0',
+    'LOG_LEVEL': 'WARNING',
+}
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+FIRST_POLL_SNIPPET = """
+import time
+launch = time.perf_counter()
+import asyncio
+import main
+
+async def run():
+    bot = main.GmailVerificationBot()
+    main.STARTUP_TIME = launch
+
+    async def fake_auth():
+        await asyncio.sleep({auth_latency})
+        return True
+
+    async def fake_prepare():
+        await asyncio.sleep({telegram_latency})
+
+    async def fake_status(text):
+        await asyncio.sleep({telegram_latency})
+
+    async def first_poll():
+        bot.running = False
+
+    bot.gmail_service.authenticate = fake_auth
+    bot.telegram_service.prepare = fake_prepare
+    bot.telegram_service.send_status_message = fake_status
+    bot.check_gmail = first_poll
+
+    await bot.initialize()
+    await bot.monitoring_loop()
+    print(bot.time_to_first_poll)
+
+asyncio.run(run())
+"""
+
+
+def run_snippet(code: str, workdir: str) -> float:
+    """Run a snippet in a fresh interpreter and return the printed timing"""
+    env = dict(os.environ, **BENCH_ENV, PYTHONPATH=str(PROJECT_DIR))
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        cwd=workdir, env=env, capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def report(name: str, samples: list):
+    """Print median/min/max for a set of samples"""
+    print(
+        f"{name:<24} median {statistics.median(samples) * 1000:8.1f} ms   "
+        f"min {min(samples) * 1000:8.1f} ms   "
+        f"max {max(samples) * 1000:8.1f} ms"
+    )
+
+
+def main():
+    """Main benchmark function"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--auth-latency', type=float, default=0.5)
+    parser.add_argument('--telegram-latency', type=float, default=0.3)
+    args = parser.parse_args()
+
+    print("⏱️  Gmail Verification Bot Startup Benchmark")
+    print("=" * 40)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Warm up bytecode caches so the first run isn't an outlier
+        run_snippet(IMPORT_SNIPPET.format(module='main'), workdir)
+
+        print("\n📦 Import time:")
+        for module in ('config', 'gmail_service', 'telegram_service', 'main'):
+            samples = [
+                run_snippet(IMPORT_SNIPPET.format(module=module), workdir)
+                for _ in range(args.runs)
+            ]
+            report(module, samples)
+
+        print(
+            f"\n🚀 Time to first poll (auth {args.auth_latency}s, "
+            f"telegram {args.telegram_latency}s):"
+        )
+        code = FIRST_POLL_SNIPPET.format(
+            auth_latency=args.auth_latency,
+            telegram_latency=args.telegram_latency
+        )
+        samples = [run_snippet(code, workdir) for _ in range(args.runs)]
+        report('first poll', samples)
+
+
+if __name__ == "__main__":
+    main()
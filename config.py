@@ -1,13 +1,19 @@
-from dataclasses import dataclass
-from typing import List
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
 import os
+import secrets
 from dotenv import load_dotenv
+from gmail_limits import GMAIL_USER_UNITS_PER_SECOND
+from message_formats import FORMATS as MESSAGE_FORMATS
 
 # Load environment variables
 load_dotenv()
 
+# Per-process webhook secret, fine since the webhook is set on every start
+DEFAULT_WEBHOOK_SECRET = secrets.token_urlsafe(32)
 
-@dataclass
+
+@dataclass(frozen=True)
 class Config:
     # Telegram Configuration
     telegram_bot_token: str
@@ -24,6 +30,63 @@ class Config:
     check_interval: int
     verification_keywords: List[str]
 
+    # Gmail Account (key in the credentials store)
+    gmail_account: str = 'default'
+
+    # Gmail Quota / Circuit Breaker
+    gmail_quota_units_per_second: int = 200
+    gmail_breaker_failure_threshold: int = 5
+    gmail_breaker_reset_timeout: int = 60
+
+    # Message Pipeline (messages per check, queue size between stages)
+    gmail_max_results: int = 10
+    pipeline_queue_size: int = 4
+
+    # Gmail API Record/Replay (for offline performance tests)
+    gmail_record_file: str = ''
+    gmail_replay_file: str = ''
+    gmail_replay_latency_ms: int = 0
+
+    # Profiling (share of polls with stage timings, capture length)
+    profile_sample_rate: float = 0.1
+    profile_seconds: int = 30
+
+    # Message Format (HTML, plain or MarkdownV2), optionally per chat
+    telegram_message_format: str = 'HTML'
+    telegram_chat_formats: Dict[str, str] = field(default_factory=dict)
+
+    # Message Coalescing (one Telegram message per poll/window per chat)
+    message_coalescing: bool = False
+    coalesce_window: int = 0
+
+    # Edit a sender's recent message when a newer code arrives (0 disables)
+    code_edit_window: int = 0
+    mark_expired_codes: bool = False
+
+    # Command Throttling (per-user commands per minute, 0 disables; burst)
+    command_rate_limit: int = 20
+    command_burst: int = 5
+
+    # Stats (ring buffer of recent events for /stats and /recent)
+    stats_buffer_size: int = 500
+
+    # HTTP Server (health checks), port 0 disables it
+    http_host: str = '0.0.0.0'
+    http_port: int = 8080
+
+    # Telegram Webhook (served by the HTTP server), empty URL uses polling
+    telegram_webhook_url: str = ''
+    telegram_webhook_path: str = '/telegram/webhook'
+    telegram_webhook_secret: str = ''
+
+    # Graceful Shutdown (drain deadline, sync state checkpoint; empty disables)
+    shutdown_timeout: int = 20
+    state_file: str = 'state.json'
+
+    # Config Reload
+    config_file: str = '.env'
+    config_reload_interval: int = 10
+
     @classmethod
     def from_env(cls) -> 'Config':
         """Create Config instance from environment variables"""
@@ -44,11 +107,55 @@ class Config:
         if not gmail_client_secret:
             raise ValueError("GMAIL_CLIENT_SECRET is required")
 
+        http_port = int(os.getenv('HTTP_PORT', 8080))
+        telegram_webhook_url = os.getenv('TELEGRAM_WEBHOOK_URL', '')
+        if telegram_webhook_url and not http_port:
+            raise ValueError("HTTP_PORT is required when TELEGRAM_WEBHOOK_URL is set")
+
+        gmail_record_file = os.getenv('GMAIL_RECORD_FILE', '')
+        gmail_replay_file = os.getenv('GMAIL_REPLAY_FILE', '')
+        if gmail_record_file and gmail_replay_file:
+            raise ValueError(
+                "GMAIL_RECORD_FILE and GMAIL_REPLAY_FILE can't both be set"
+            )
+
+        stats_buffer_size = int(os.getenv('STATS_BUFFER_SIZE', 500))
+        if stats_buffer_size < 1:
+            raise ValueError("STATS_BUFFER_SIZE must be at least 1")
+
+        gmail_quota_units_per_second = int(
+            os.getenv('GMAIL_QUOTA_UNITS_PER_SECOND', 200)
+        )
+        if gmail_quota_units_per_second > GMAIL_USER_UNITS_PER_SECOND:
+            raise ValueError(
+                f"GMAIL_QUOTA_UNITS_PER_SECOND can't exceed Gmail's limit of "
+                f"{GMAIL_USER_UNITS_PER_SECOND} units per second"
+            )
+
+        command_burst = int(os.getenv('COMMAND_BURST', 5))
+        if command_burst < 1:
+            raise ValueError("COMMAND_BURST must be at least 1")
+
         # Parse chat IDs (comma-separated)
         telegram_chat_ids = [
             chat_id.strip() for chat_id in telegram_chat_ids_str.split(',')
         ]
 
+        # Parse per-chat message formats (chat_id:format, comma-separated)
+        telegram_chat_formats = {}
+        for entry in os.getenv('TELEGRAM_CHAT_FORMATS', '').split(','):
+            if entry.strip():
+                chat_id, _, fmt = entry.partition(':')
+                telegram_chat_formats[chat_id.strip()] = fmt.strip()
+
+        message_format = os.getenv('TELEGRAM_MESSAGE_FORMAT', 'HTML')
+        for fmt in [message_format, *telegram_chat_formats.values()]:
+            if fmt not in MESSAGE_FORMATS:
+                raise ValueError(
+                    f"Unknown message format '{fmt}', "
+                    f"expected one of: {', '.join(MESSAGE_FORMATS)}"
+                )
+
         # Parse admin IDs (comma-separated)
         telegram_admin_ids = [
             admin_id.strip() for admin_id in telegram_admin_ids_str.split(',')
@@ -62,13 +169,62 @@ class Config:
             gmail_client_secret=gmail_client_secret,
             gmail_token_file=os.getenv('GMAIL_TOKEN_FILE', 'token.json'),
             gmail_scopes=['https://www.googleapis.com/auth/gmail.readonly'],
+            gmail_account=os.getenv('GMAIL_ACCOUNT', 'default'),
             check_interval=int(os.getenv('CHECK_INTERVAL', 30)),
             verification_keywords=os.getenv(
                 'VERIFICATION_KEYWORDS',
                 'verification,code,verify,2FA,two-factor,OTP,one-time'
-            ).split(',')
+            ).split(','),
+            gmail_quota_units_per_second=gmail_quota_units_per_second,
+            gmail_breaker_failure_threshold=int(
+                os.getenv('GMAIL_BREAKER_FAILURE_THRESHOLD', 5)
+            ),
+            gmail_breaker_reset_timeout=int(
+                os.getenv('GMAIL_BREAKER_RESET_TIMEOUT', 60)
+            ),
+            gmail_max_results=int(os.getenv('GMAIL_MAX_RESULTS', 10)),
+            pipeline_queue_size=int(os.getenv('PIPELINE_QUEUE_SIZE', 4)),
+            gmail_record_file=gmail_record_file,
+            gmail_replay_file=gmail_replay_file,
+            gmail_replay_latency_ms=int(os.getenv('GMAIL_REPLAY_LATENCY_MS', 0)),
+            profile_sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', 0.1)),
+            profile_seconds=int(os.getenv('PROFILE_SECONDS', 30)),
+            telegram_message_format=message_format,
+            telegram_chat_formats=telegram_chat_formats,
+            message_coalescing=os.getenv(
+                'MESSAGE_COALESCING', 'false'
+            ).lower() in ('1', 'true', 'yes'),
+            coalesce_window=int(os.getenv('COALESCE_WINDOW', 0)),
+            code_edit_window=int(os.getenv('CODE_EDIT_WINDOW', 0)),
+            mark_expired_codes=os.getenv(
+                'MARK_EXPIRED_CODES', 'false'
+            ).lower() in ('1', 'true', 'yes'),
+            command_rate_limit=int(os.getenv('COMMAND_RATE_LIMIT', 20)),
+            command_burst=command_burst,
+            stats_buffer_size=stats_buffer_size,
+            http_host=os.getenv('HTTP_HOST', '0.0.0.0'),
+            http_port=http_port,
+            telegram_webhook_url=telegram_webhook_url,
+            telegram_webhook_path=os.getenv(
+                'TELEGRAM_WEBHOOK_PATH', '/telegram/webhook'
+            ),
+            # An empty secret would make the webhook accept any request
+            telegram_webhook_secret=(
+                os.getenv('TELEGRAM_WEBHOOK_SECRET') or DEFAULT_WEBHOOK_SECRET
+            ),
+            shutdown_timeout=int(os.getenv('SHUTDOWN_TIMEOUT', 20)),
+            state_file=os.getenv('STATE_FILE', 'state.json'),
+            config_file=os.getenv('CONFIG_FILE', '.env'),
+            config_reload_interval=int(os.getenv('CONFIG_RELOAD_INTERVAL', 10))
         )
 
 
+def load_config(env_file: Optional[str] = None) -> Config:
+    """Re-read the env file (overriding current values) and build a new Config"""
+    if env_file and os.path.exists(env_file):
+        load_dotenv(env_file, override=True)
+    return Config.from_env()
+
+
 # Global config instance
 config = Config.from_env()
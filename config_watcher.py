@@ -0,0 +1,133 @@
+import asyncio
+import os
+import logging
+from dataclasses import replace
+from typing import Callable, List, Optional, Set
+from dotenv import dotenv_values
+from config import Config, load_config
+
+logger = logging.getLogger(__name__)
+
+# How often to look again for CONFIG_RELOAD_INTERVAL being turned back on
+DISABLED_RECHECK_INTERVAL = 10
+
+# Fields that are bound to live clients/credentials and need a restart
+RESTART_REQUIRED_FIELDS = (
+    'telegram_bot_token',
+    'gmail_client_id',
+    'gmail_client_secret',
+    'gmail_token_file',
+    'gmail_scopes',
+    'gmail_account',
+    'gmail_record_file',
+    'gmail_replay_file',
+    'gmail_replay_latency_ms',
+    'state_file',
+    'config_file',
+    'http_host',
+    'http_port',
+    'stats_buffer_size',
+    'telegram_webhook_url',
+    'telegram_webhook_path',
+    'telegram_webhook_secret',
+)
+
+
+class ConfigWatcher:
+    def __init__(self, config: Config):
+        self.config = config
+        self._subscribers: List[Callable[[Config], None]] = []
+        self._lock = asyncio.Lock()
+        self._mtime = self._get_mtime()
+        self._env_keys = self._get_env_keys()
+
+    def subscribe(self, callback: Callable[[Config], None]):
+        """Register a callback that receives every new config snapshot"""
+        self._subscribers.append(callback)
+
+    def _get_mtime(self) -> Optional[float]:
+        """Get modification time of the watched env file"""
+        try:
+            return os.stat(self.config.config_file).st_mtime
+        except OSError:
+            return None
+
+    def _get_env_keys(self) -> Set[str]:
+        """Get the keys currently set in the watched env file"""
+        try:
+            return set(dotenv_values(self.config.config_file))
+        except OSError:
+            return set()
+
+    def _clear_removed_keys(self):
+        """Unset keys that were removed from the env file so defaults apply"""
+        if not os.path.exists(self.config.config_file):
+            # Likely mid-save; don't wipe the environment over it
+            return
+        keys = self._get_env_keys()
+        for key in self._env_keys - keys:
+            logger.info(f"{key} was removed from the env file, unsetting it")
+            os.environ.pop(key, None)
+        self._env_keys = keys
+
+    async def reload(self) -> Optional[Config]:
+        """Re-read configuration and swap it in if anything changed.
+
+        Returns the new config, or None if nothing changed. Raises
+        ValueError if the new configuration is invalid; the current
+        config stays active in that case.
+        """
+        async with self._lock:
+            self._mtime = self._get_mtime()
+            self._clear_removed_keys()
+            new_config = load_config(self.config.config_file)
+
+            # Keep values that can't change without a restart
+            pinned = {
+                field: getattr(self.config, field)
+                for field in RESTART_REQUIRED_FIELDS
+                if getattr(new_config, field) != getattr(self.config, field)
+            }
+            if pinned:
+                logger.warning(
+                    f"Ignoring changes to {', '.join(pinned)} - "
+                    f"restart required to apply them"
+                )
+                new_config = replace(new_config, **pinned)
+
+            if new_config == self.config:
+                logger.info("Configuration unchanged")
+                return None
+
+            self.config = new_config
+            for callback in self._subscribers:
+                callback(new_config)
+
+            logger.info("Configuration reloaded")
+            return new_config
+
+    async def watch(self):
+        """Poll the env file and reload configuration when it changes.
+
+        With CONFIG_RELOAD_INTERVAL at 0 the file isn't polled, but a
+        /reload that sets it again turns polling back on.
+        """
+        logger.info(f"Watching {self.config.config_file} for changes...")
+        disabled = False
+        while True:
+            if self.config.config_reload_interval <= 0:
+                if not disabled:
+                    logger.info("Config file watching disabled")
+                    disabled = True
+                await asyncio.sleep(DISABLED_RECHECK_INTERVAL)
+                continue
+            if disabled:
+                logger.info("Config file watching re-enabled")
+                disabled = False
+            await asyncio.sleep(self.config.config_reload_interval)
+            if self._get_mtime() == self._mtime:
+                continue
+            try:
+                await self.reload()
+            except Exception as e:
+                logger.error(f"Failed to reload configuration: {e}")
@@ -0,0 +1,134 @@
+import json
+import os
+import tempfile
+import threading
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+STORE_VERSION = 1
+
+
+class CredentialsStore:
+    """Versioned JSON store of Gmail OAuth credentials keyed by account.
+
+    The file is read once and cached in memory. Writes are atomic and only
+    happen when an account's token actually changes. Legacy pickled
+    Credentials files and plain token JSON are migrated on first load,
+    under the account that loads them.
+    """
+
+    _instances: Dict[str, 'CredentialsStore'] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path: str):
+        self.path = path
+        self._accounts: Optional[Dict[str, Dict]] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_path(cls, path: str) -> 'CredentialsStore':
+        """Get the shared store for a file so accounts share one cache"""
+        key = os.path.abspath(path)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(path)
+            return cls._instances[key]
+
+    def get(self, account: str, scopes: List[str]):
+        """Get credentials for an account, or None if there are none"""
+        from google.oauth2.credentials import Credentials
+
+        with self._lock:
+            info = self._load(account).get(account)
+        if not info:
+            return None
+
+        try:
+            return Credentials.from_authorized_user_info(info, scopes)
+        except Exception as e:
+            logger.warning(f"Stored credentials for '{account}' are invalid: {e}")
+            return None
+
+    def save(self, account: str, creds) -> bool:
+        """Save credentials for an account; returns False if unchanged"""
+        info = json.loads(creds.to_json())
+        with self._lock:
+            accounts = self._load(account)
+            if accounts.get(account) == info:
+                return False
+            accounts[account] = info
+            self._write()
+        logger.info(f"Saved credentials for account '{account}'")
+        return True
+
+    def _load(self, account: str) -> Dict[str, Dict]:
+        """Load the store from disk once (caller holds the lock).
+
+        A single-account legacy file is stored under the given account.
+        """
+        if self._accounts is not None:
+            return self._accounts
+
+        self._accounts = {}
+        if not os.path.exists(self.path):
+            return self._accounts
+
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+
+        try:
+            data = json.loads(raw)
+            if 'accounts' in data:
+                self._accounts = data['accounts']
+            else:
+                # Plain authorized-user JSON for a single account
+                self._accounts = {account: data}
+            return self._accounts
+        except (ValueError, UnicodeDecodeError):
+            pass
+
+        try:
+            self._accounts = {account: self._load_legacy_pickle(raw)}
+            self._write()
+            logger.info(
+                f"Migrated pickled token in {self.path} to JSON store "
+                f"for account '{account}'"
+            )
+        except Exception as e:
+            # Keep the unreadable file around instead of deleting it
+            backup = f"{self.path}.corrupt"
+            os.replace(self.path, backup)
+            logger.error(
+                f"Could not read credentials from {self.path} ({e}); "
+                f"moved it to {backup}"
+            )
+        return self._accounts
+
+    @staticmethod
+    def _load_legacy_pickle(raw: bytes) -> Dict:
+        """Convert a pickled Credentials object to authorized-user info"""
+        import pickle
+
+        creds = pickle.loads(raw)
+        return json.loads(creds.to_json())
+
+    def _write(self):
+        """Atomically write the store to disk (caller holds the lock)"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.token-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(
+                    {'version': STORE_VERSION, 'accounts': self._accounts},
+                    f, indent=2
+                )
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
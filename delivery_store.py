@@ -0,0 +1,79 @@
+import time
+from collections import OrderedDict
+from datetime import datetime
+from email.utils import parseaddr
+from typing import List, Optional, Tuple
+
+# Replaced codes kept on an edited message
+MAX_EXPIRED_CODES = 5
+
+
+def normalize_sender(sender: str) -> str:
+    """Reduce a From header to a lowercase address"""
+    _, address = parseaddr(sender)
+    return (address or sender).strip().lower()
+
+
+class DeliveredMessage:
+    """A verification message recently sent to one chat"""
+
+    __slots__ = ('message_id', 'date', 'codes', 'expired_codes', 'updated_at')
+
+    def __init__(self, message_id: int, date: datetime, codes: List[str],
+                 expired_codes: List[str], updated_at: float):
+        self.message_id = message_id
+        # Date of the email whose codes the message shows
+        self.date = date
+        self.codes = codes
+        self.expired_codes = expired_codes
+        self.updated_at = updated_at
+
+    def replaced_codes(self, new_codes: List[str]) -> List[str]:
+        """Codes that become expired when this message shows new_codes"""
+        replaced = []
+        for code in self.codes + self.expired_codes:
+            if code not in new_codes and code not in replaced:
+                replaced.append(code)
+        return replaced[:MAX_EXPIRED_CODES]
+
+
+class DeliveryStore:
+    """Recently delivered messages indexed by (normalized sender, chat).
+
+    Entries expire ttl seconds after their last update. Entries are kept
+    in update order, so expiry only looks at the oldest ones.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: 'OrderedDict[Tuple[str, str], DeliveredMessage]' = (
+            OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, sender: str, chat_id: str) -> Optional[DeliveredMessage]:
+        """Get the live entry for a sender in a chat, if any"""
+        self.prune()
+        return self._entries.get((normalize_sender(sender), chat_id))
+
+    def put(self, sender: str, chat_id: str, message_id: int, date: datetime,
+            codes: List[str], expired_codes: Optional[List[str]] = None):
+        """Record a sent or edited message"""
+        key = (normalize_sender(sender), chat_id)
+        self._entries.pop(key, None)
+        self._entries[key] = DeliveredMessage(
+            message_id, date, list(codes), list(expired_codes or []),
+            time.monotonic()
+        )
+        self.prune()
+
+    def prune(self):
+        """Drop entries older than the TTL"""
+        cutoff = time.monotonic() - self.ttl
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if entry.updated_at > cutoff:
+                break
+            self._entries.popitem(last=False)
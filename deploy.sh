@@ -6,12 +6,17 @@ set -e
 
 echo "🚀 Deploying Gmail Verification Bot..."
 
-# Check if .env file exists
-if [ ! -f .env ]; then
-    echo "❌ .env file not found!"
-    echo "📝 Please copy .env.production to .env and configure it:"
-    echo "   cp .env.production .env"
-    echo "   nano .env"
+# Check if config/.env file exists (mounted into the container for reload)
+if [ ! -f config/.env ]; then
+    echo "❌ config/.env file not found!"
+    if [ -f .env ]; then
+        echo "📝 Move your existing .env into the config directory:"
+        echo "   mkdir -p config && mv .env config/.env"
+    else
+        echo "📝 Please copy .env.production to config/.env and configure it:"
+        echo "   mkdir -p config && cp .env.production config/.env"
+        echo "   nano config/.env"
+    fi
     exit 1
 fi
 
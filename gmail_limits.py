@@ -0,0 +1,151 @@
+import asyncio
+import time
+import logging
+from collections import deque, Counter
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Gmail API quota units per method
+# https://developers.google.com/gmail/api/reference/quota
+QUOTA_COSTS = {
+    'messages.list': 5,
+    'messages.get': 5,
+    'history.list': 2,
+}
+
+# Gmail allows 250 units per user per second (moving average)
+GMAIL_USER_UNITS_PER_SECOND = 250
+
+
+class QuotaTracker:
+    """Account for Gmail quota units and throttle before hitting the limit"""
+
+    def __init__(self, units_per_second: float = 200, report_window: float = 60):
+        self.units_per_second = units_per_second
+        self.report_window = report_window
+        self._recent = deque()  # (timestamp, units) within the last second
+        self._history = deque()  # (timestamp, units) within report_window
+        self.calls = Counter()
+        self.units = Counter()
+        self.throttled_seconds = 0.0
+
+    def _prune(self, now: float):
+        """Drop entries that fell out of the tracking windows"""
+        while self._recent and now - self._recent[0][0] >= 1.0:
+            self._recent.popleft()
+        while self._history and now - self._history[0][0] >= self.report_window:
+            self._history.popleft()
+
+    async def acquire(self, method: str):
+        """Wait until the call fits in the per-second budget, then record it"""
+        cost = QUOTA_COSTS[method]
+        while True:
+            now = time.monotonic()
+            self._prune(now)
+            used = sum(units for _, units in self._recent)
+            if used + cost <= self.units_per_second or not self._recent:
+                break
+            # Sleep until the oldest call leaves the one-second window
+            delay = 1.0 - (now - self._recent[0][0])
+            self.throttled_seconds += delay
+            logger.debug(f"Throttling Gmail {method} for {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+        self._recent.append((now, cost))
+        self._history.append((now, cost))
+        self.calls[method] += 1
+        self.units[method] += cost
+
+    def burn_rate(self) -> float:
+        """Average units per second over the report window"""
+        self._prune(time.monotonic())
+        return sum(units for _, units in self._history) / self.report_window
+
+    def snapshot(self) -> Dict:
+        """Current quota usage for status reporting"""
+        return {
+            'burn_rate': self.burn_rate(),
+            'limit': self.units_per_second,
+            'calls': dict(self.calls),
+            'units': dict(self.units),
+            'total_units': sum(self.units.values()),
+            'throttled_seconds': self.throttled_seconds,
+        }
+
+
+class CircuitBreaker:
+    """Stop calling a failing API and probe it again after a cool-down"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60,
+                 max_reset_timeout: float = 900):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._current_timeout = reset_timeout
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        """Check whether a request may be made right now"""
+        if self.state == self.CLOSED:
+            return True
+
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self._current_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            logger.info("Circuit breaker half-open, probing Gmail API")
+
+        # Half-open: let a single probe through
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self):
+        """Close the breaker after a successful request"""
+        if self.state != self.CLOSED:
+            logger.info("Circuit breaker closed, Gmail API recovered")
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._current_timeout = self.reset_timeout
+        self._probe_in_flight = False
+
+    def record_failure(self, retry_after: Optional[float] = None):
+        """Count a failure and open the breaker if needed"""
+        self.failures += 1
+        self._probe_in_flight = False
+
+        if self.state == self.HALF_OPEN:
+            # Probe failed: back off longer before the next one
+            self._current_timeout = min(
+                self._current_timeout * 2, self.max_reset_timeout
+            )
+        elif self.failures < self.failure_threshold and retry_after is None:
+            return
+
+        if retry_after is not None:
+            self._current_timeout = max(self._current_timeout, retry_after)
+
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        logger.warning(
+            f"Circuit breaker open after {self.failures} failures, "
+            f"retrying in {self._current_timeout:.0f}s"
+        )
+
+    def seconds_until_retry(self) -> float:
+        """Time left before the next probe is allowed"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(
+            0.0, self._current_timeout - (time.monotonic() - self.opened_at)
+        )
@@ -0,0 +1,139 @@
+import gzip
+import json
+import threading
+import time
+import logging
+from collections import deque
+from typing import Dict, Deque, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Response headers worth keeping; the rest only add size to recordings
+RECORDED_HEADERS = ('content-type', 'retry-after')
+
+
+def request_key(method: str, uri: str, body: Optional[str] = None) -> str:
+    """Identify a request by method, path, query parameters and body"""
+    parts = urlsplit(uri)
+    query = '&'.join(
+        f'{name}={value}' for name, value in sorted(parse_qsl(parts.query))
+    )
+    return f'{method} {parts.path}?{query} {body or ""}'
+
+
+def _response(status: int, headers: Dict[str, str]):
+    """Build the httplib2 response object googleapiclient expects"""
+    import httplib2
+
+    info = {'status': str(status)}
+    info.update(headers)
+    return httplib2.Response(info)
+
+
+class RecordingHttp:
+    """Pass requests through to an http object and log the responses.
+
+    Responses are appended to a gzip-compressed JSON Lines file, one
+    request per line. Wrap the authorized http object (not the inner
+    transport) so token refreshes, and the tokens in them, aren't
+    recorded. Recordings do contain email contents.
+    """
+
+    def __init__(self, http, path: str):
+        self.http = http
+        self.path = path
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        """Make a request and record its response"""
+        start = time.perf_counter()
+        resp, content = self.http.request(
+            uri, method=method, body=body, headers=headers, **kwargs
+        )
+        elapsed = time.perf_counter() - start
+
+        if isinstance(body, bytes):
+            body = body.decode('utf-8', 'replace')
+        entry = {
+            'key': request_key(method, uri, body),
+            'status': resp.status,
+            'headers': {
+                name: resp[name] for name in RECORDED_HEADERS if name in resp
+            },
+            'content': content.decode('utf-8', 'replace'),
+            'elapsed': round(elapsed, 4),
+        }
+        with self._lock:
+            self._file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+            self._file.flush()
+            self.recorded += 1
+        return resp, content
+
+    def close(self):
+        """Flush the recording and close the wrapped http object"""
+        with self._lock:
+            self._file.close()
+        self.http.close()
+
+    def __getattr__(self, name):
+        # redirect_codes, timeout etc. belong to the wrapped object
+        return getattr(self.http, name)
+
+
+class ReplayHttp:
+    """Answer requests from a recording made by RecordingHttp.
+
+    Responses for the same request are returned in recorded order and the
+    last one repeats once they run out, so a recording of one poll can
+    serve any number of polls. Unknown requests get a 404. The latency is
+    slept in the calling thread, like a real network round trip.
+    """
+
+    def __init__(self, path: str, latency: float = 0.0):
+        self.path = path
+        self.latency = latency
+        self._responses: Dict[str, Deque[Tuple[int, Dict, bytes]]] = {}
+        self._lock = threading.Lock()
+        self.redirect_codes = frozenset()
+        self.requests = 0
+        self.misses = 0
+
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                self._responses.setdefault(entry['key'], deque()).append((
+                    entry['status'], entry['headers'],
+                    entry['content'].encode('utf-8')
+                ))
+        logger.info(
+            f"Loaded {sum(map(len, self._responses.values()))} recorded Gmail "
+            f"responses for {len(self._responses)} requests from {path}"
+        )
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        """Return the recorded response for a request"""
+        if self.latency:
+            time.sleep(self.latency)
+
+        if isinstance(body, bytes):
+            body = body.decode('utf-8', 'replace')
+        key = request_key(method, uri, body)
+        with self._lock:
+            self.requests += 1
+            responses = self._responses.get(key)
+            if not responses:
+                self.misses += 1
+                logger.warning(f"No recorded Gmail response for {key}")
+                return _response(404, {'content-type': 'application/json'}), (
+                    b'{"error": {"code": 404, "message": "Not recorded"}}'
+                )
+            status, resp_headers, content = (
+                responses.popleft() if len(responses) > 1 else responses[0]
+            )
+        return _response(status, resp_headers), content
+
+    def close(self):
+        """Nothing to release"""
@@ -1,29 +1,116 @@
+import asyncio
 import os
-import pickle
+import time
 import base64
 import re
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Optional
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+from typing import Any, Awaitable, Callable, List, Dict, Optional
 import logging
+from collections import OrderedDict
+from credentials_store import CredentialsStore
+from gmail_limits import QuotaTracker, CircuitBreaker
+from pipeline import MessagePipeline
+from profiling import span
+
+# Google client libraries are imported lazily: they are only needed once
+# authentication starts, which runs in a worker thread during startup.
 
 logger = logging.getLogger(__name__)
 
+# Largest page the Gmail API returns for messages.list
+GMAIL_MAX_PAGE_SIZE = 500
+
+# Handled message IDs remembered to skip refetching them on later polls
+SEEN_IDS_LIMIT = 2000
+
+# Date headers are sender clock values; messages dated this far before the
+# last check are still delivered, with seen IDs doing the actual dedupe
+DATE_LOOKBACK_GRACE = timedelta(minutes=15)
+
+HTML_TAG_PATTERN = re.compile(r'<[^>]+>')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Verification code patterns, matched case-insensitively
+CODE_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE) for pattern in (
+        r'\b\d{6}\b',  # 6-digit codes
+        # r'\b\d{4}\b',  # 4-digit codes
+        # r'\b\d{8}\b',  # 8-digit codes
+        # r'\b[A-Z0-9]{6}\b',  # 6-character alphanumeric codes
+        # r'\b[A-Z0-9]{8}\b',  # 8-character alphanumeric codes
+    )
+]
+
+
+class DecodedMessage:
+    """Headers and body text of a message, without the raw payload"""
+
+    __slots__ = ('id', 'subject', 'sender', 'date', 'body')
+
+    def __init__(self, id: str, subject: str, sender: str, date: str,
+                 body: str):
+        self.id = id
+        self.subject = subject
+        self.sender = sender
+        self.date = date
+        self.body = body
+
+
+class VerificationMessage:
+    """A new verification email, reduced to what delivery needs"""
+
+    __slots__ = ('id', 'subject', 'sender', 'date', 'codes')
+
+    def __init__(self, id: str, subject: str, sender: str, date: datetime,
+                 codes: List[str]):
+        self.id = id
+        self.subject = subject
+        self.sender = sender
+        self.date = date
+        self.codes = codes
+
 
 class GmailService:
     def __init__(self, client_id: str, client_secret: str, token_file: str,
-                 scopes: List[str], telegram_service=None):
+                 scopes: List[str], telegram_service=None,
+                 account: str = 'default',
+                 quota_units_per_second: float = 200,
+                 breaker_failure_threshold: int = 5,
+                 breaker_reset_timeout: float = 60,
+                 max_results: int = 10,
+                 pipeline_queue_size: int = 4,
+                 record_file: str = '',
+                 replay_file: str = '',
+                 replay_latency: float = 0.0):
         self.client_id = client_id
         self.client_secret = client_secret
         self.token_file = token_file
         self.scopes = scopes
+        self.account = account
+        self.credentials_store = CredentialsStore.for_path(token_file)
+        self.credentials = None
         self.service = None
         self.telegram_service = telegram_service
+        self.last_successful_check: Optional[float] = None
+        self.quota = QuotaTracker(quota_units_per_second)
+        self.circuit_breaker = CircuitBreaker(
+            failure_threshold=breaker_failure_threshold,
+            reset_timeout=breaker_reset_timeout
+        )
+        self.max_results = max_results
+        # Record API responses to, or replay them from, a file
+        self.record_file = record_file
+        self.replay_file = replay_file
+        self.replay_latency = replay_latency
+        self.pipeline_queue_size = pipeline_queue_size
+        # Pipeline of the current (or last) check, for queue depth reporting
+        self.pipeline: Optional[MessagePipeline] = None
         # Start 5 minutes ago with timezone awareness
         self.last_check_time = datetime.now(timezone.utc) - timedelta(minutes=5)
+        # IDs of delivered or already-old messages, oldest first
+        self.seen_ids: 'OrderedDict[str, None]' = OrderedDict()
+        # Bumped whenever a message is marked seen, for checkpointing
+        self.state_version = 0
 
     async def send_auth_error_notification(self):
         """Send Telegram notification when Gmail authentication is required"""
@@ -48,12 +135,30 @@ class GmailService:
 
     async def authenticate(self) -> bool:
         """Authenticate with Gmail API using environment variables"""
+        # Imports, token refresh and client build are blocking, so run them
+        # off the event loop to overlap with the rest of startup
+        return await asyncio.to_thread(self._authenticate)
+
+    def _authenticate(self) -> bool:
+        """Blocking part of authentication"""
         try:
-            creds = None
+            from google.auth.transport.requests import Request
+            from google_auth_oauthlib.flow import InstalledAppFlow
+            from googleapiclient.discovery import build
+
+            if self.replay_file:
+                # Serve recorded responses; no credentials are needed
+                from gmail_recording import ReplayHttp
+                self.service = build('gmail', 'v1', http=ReplayHttp(
+                    self.replay_file, self.replay_latency
+                ))
+                logger.info(
+                    f"Replaying Gmail API responses from {self.replay_file}"
+                )
+                return True
+
             # Load existing token
-            if os.path.exists(self.token_file):
-                with open(self.token_file, 'rb') as token:
-                    creds = pickle.load(token)
+            creds = self.credentials_store.get(self.account, self.scopes)
 
             # If there are no (valid) credentials available, let user log in
             if not creds or not creds.valid:
@@ -87,28 +192,48 @@ class GmailService:
                         client_config, self.scopes
                     )
                     # Use headless authentication for server environments
-                    creds = await self._headless_auth(flow)
-
-            # Save the credentials for the next run
-            with open(self.token_file, 'wb') as token:
-                pickle.dump(creds, token)
-
-            self.service = build('gmail', 'v1', credentials=creds)
+                    creds = self._headless_auth(flow)
+
+            # Save the credentials for the next run (no-op if unchanged)
+            self.credentials_store.save(self.account, creds)
+            self.credentials = creds
+
+            if self.record_file:
+                import httplib2
+                from google_auth_httplib2 import AuthorizedHttp
+                from gmail_recording import RecordingHttp
+                http = RecordingHttp(
+                    AuthorizedHttp(creds, http=httplib2.Http()),
+                    self.record_file
+                )
+                self.service = build('gmail', 'v1', http=http)
+                logger.info(
+                    f"Recording Gmail API responses to {self.record_file}"
+                )
+            else:
+                self.service = build('gmail', 'v1', credentials=creds)
             logger.info("Gmail authentication successful")
             return True
 
         except Exception as e:
             logger.error(f"Gmail authentication failed: {e}")
-            # Clean up corrupted token file
-            if os.path.exists(self.token_file):
-                try:
-                    os.remove(self.token_file)
-                    logger.info("Removed corrupted token file")
-                except Exception as cleanup_error:
-                    logger.warning(f"Failed to remove token file: {cleanup_error}")
             return False
 
-    async def _headless_auth(self, flow):
+    def close(self):
+        """Close the API client (and finish any recording)"""
+        if self.service:
+            self.service.close()
+
+    def _save_credentials(self):
+        """Persist credentials if the client refreshed the token"""
+        if not self.credentials:
+            return
+        try:
+            self.credentials_store.save(self.account, self.credentials)
+        except Exception as e:
+            logger.warning(f"Failed to save refreshed credentials: {e}")
+
+    def _headless_auth(self, flow):
         """Perform headless OAuth authentication"""
         # Configure the flow for out-of-band (manual) authentication
         flow.redirect_uri = 'urn:ietf:wg:oauth:2.0:oob'
@@ -179,12 +304,29 @@ class GmailService:
             flow.fetch_token(code=auth_code)
             return flow.credentials
 
-    async def get_recent_messages(self, keywords: List[str]) -> List[Dict]:
-        """Get recent messages containing verification keywords"""
+    async def get_recent_messages(
+            self, keywords: List[str],
+            render: Optional[Callable[[VerificationMessage], Any]] = None,
+            deliver: Optional[Callable[[VerificationMessage, Any], Awaitable]] = None
+    ) -> List[VerificationMessage]:
+        """Get recent messages containing verification keywords.
+
+        Messages are streamed through a bounded pipeline; pass render and
+        deliver to send each one as soon as it is extracted.
+        """
+        from googleapiclient.errors import HttpError
+
         if not self.service:
             logger.error("Gmail service not authenticated")
             return []
 
+        if not self.circuit_breaker.allow():
+            logger.debug(
+                f"Gmail circuit breaker open, skipping check "
+                f"({self.circuit_breaker.seconds_until_retry():.0f}s left)"
+            )
+            return []
+
         try:
             # Create query for verification emails
             keyword_query = ' OR '.join([
@@ -192,31 +334,53 @@ class GmailService:
             ])
             query = f'({keyword_query}) AND newer_than:1h'
 
-            # Get message list
-            result = self.service.users().messages().list(
-                userId='me',
-                q=query,
-                maxResults=10
-            ).execute()
-
-            messages = result.get('messages', [])
-            verification_messages = []
+            message_ids = [
+                message_id for message_id in await self._list_message_ids(query)
+                if message_id not in self.seen_ids
+            ]
 
-            for message in messages:
-                msg_data = await self._get_message_details(message['id'])
-                if msg_data and self._is_new_message(msg_data['date']):
-                    verification_messages.append(msg_data)
+            if deliver:
+                async def deliver_and_mark(record, rendered):
+                    await deliver(record, rendered)
+                    # Not redelivered even if the rest of this check fails
+                    self._mark_seen(record.id)
+            else:
+                deliver_and_mark = None
+
+            self.pipeline = MessagePipeline(
+                fetch=self._fetch_message,
+                decode=self._decode_message,
+                extract=self._extract_message,
+                render=render,
+                deliver=deliver_and_mark,
+                queue_size=self.pipeline_queue_size
+            )
+            verification_messages = await self.pipeline.run(message_ids)
+            if not deliver:
+                for msg in verification_messages:
+                    self._mark_seen(msg.id)
 
             # Update last check time
             self.last_check_time = datetime.now(timezone.utc)
+            self._save_credentials()
+            self.circuit_breaker.record_success()
+            self.last_successful_check = time.monotonic()
             return verification_messages
 
         except HttpError as error:
             logger.error(f'Gmail API error: {error}')
+            if self._is_transient_error(error):
+                self.circuit_breaker.record_failure(self._get_retry_after(error))
+            else:
+                self.circuit_breaker.record_success()
             return []
         except Exception as e:
             error_str = str(e)
             logger.error(f'Error getting messages: {e}')
+            if self._is_transient_error(e):
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
 
             # Check if this is an auth error that requires manual intervention
             if 'invalid_grant' in error_str or 'Token has been expired or revoked' in error_str:
@@ -225,15 +389,52 @@ class GmailService:
 
             return []
 
-    async def _get_message_details(self, message_id: str) -> Optional[Dict]:
-        """Get detailed information about a message"""
+    async def _list_message_ids(self, query: str) -> List[str]:
+        """List IDs of messages matching a query, up to max_results"""
+        message_ids = []
+        page_token = None
+        while len(message_ids) < self.max_results:
+            with span('gmail.quota_wait'):
+                await self.quota.acquire('messages.list')
+            request = self.service.users().messages().list(
+                userId='me',
+                q=query,
+                maxResults=min(self.max_results - len(message_ids),
+                               GMAIL_MAX_PAGE_SIZE),
+                pageToken=page_token
+            )
+            with span('gmail.list'):
+                result = await asyncio.to_thread(request.execute)
+            message_ids.extend(m['id'] for m in result.get('messages', []))
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                break
+        return message_ids
+
+    async def _fetch_message(self, message_id: str) -> Optional[Dict]:
+        """Fetch stage: get the full message from the API"""
         try:
-            message = self.service.users().messages().get(
+            with span('gmail.quota_wait'):
+                await self.quota.acquire('messages.get')
+            request = self.service.users().messages().get(
                 userId='me',
                 id=message_id,
                 format='full'
-            ).execute()
+            )
+            with span('gmail.fetch'):
+                return await asyncio.to_thread(request.execute)
 
+        except Exception as e:
+            # Abort the whole check on rate limits/outages instead of
+            # hammering the API for every remaining message
+            if self._is_transient_error(e):
+                raise
+            logger.error(f'Error getting message details: {e}')
+            return None
+
+    def _decode_message(self, message: Dict) -> DecodedMessage:
+        """Decode stage: pull headers and body text out of the raw payload"""
+        with span('gmail.decode'):
             headers = message['payload'].get('headers', [])
             subject = next((
                 h['value'] for h in headers if h['name'] == 'Subject'
@@ -245,74 +446,121 @@ class GmailService:
                 h['value'] for h in headers if h['name'] == 'Date'
             ), '')
 
-            # Extract message body
-            body = self._extract_message_body(message['payload'])
+            return DecodedMessage(
+                message['id'], subject, sender, date_str,
+                self._extract_message_body(message['payload'])
+            )
+
+    def _extract_message(
+            self, decoded: DecodedMessage) -> Optional[VerificationMessage]:
+        """Extract stage: keep new messages as compact records"""
+        date = self._parse_date(decoded.date)
+        if not self._is_new_message(date):
+            return None
+
+        with span('gmail.extract'):
+            codes = self._extract_verification_codes(
+                decoded.subject + ' ' + decoded.body
+            )
+        return VerificationMessage(
+            decoded.id, decoded.subject, decoded.sender, date, codes
+        )
 
-            # Extract verification codes
-            codes = self._extract_verification_codes(subject + ' ' + body)
+    def _mark_seen(self, message_id: str):
+        """Remember a handled message so later checks don't fetch it"""
+        self.seen_ids[message_id] = None
+        self.seen_ids.move_to_end(message_id)
+        while len(self.seen_ids) > SEEN_IDS_LIMIT:
+            self.seen_ids.popitem(last=False)
+        self.state_version += 1
+
+    def checkpoint(self) -> Dict:
+        """Sync state needed to resume after a restart"""
+        return {
+            'last_check_time': self.last_check_time.isoformat(),
+            'seen_ids': list(self.seen_ids),
+        }
+
+    def restore(self, state: Dict):
+        """Resume from a checkpoint made by checkpoint()"""
+        try:
+            last_check_time = datetime.fromisoformat(state['last_check_time'])
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Ignoring checkpoint without a valid check time: {e}")
+            return
+        if last_check_time.tzinfo is None:
+            last_check_time = last_check_time.replace(tzinfo=timezone.utc)
+
+        self.last_check_time = last_check_time
+        self.seen_ids = OrderedDict.fromkeys(
+            state.get('seen_ids', [])[-SEEN_IDS_LIMIT:]
+        )
+        logger.info(
+            f"Resuming Gmail checks from {last_check_time:%Y-%m-%d %H:%M:%S %Z} "
+            f"with {len(self.seen_ids)} seen messages"
+        )
 
-            return {
-                'id': message_id,
-                'subject': subject,
-                'sender': sender,
-                'date': self._parse_date(date_str),
-                'body': body[:500],  # Limit body length
-                'codes': codes
-            }
+    def _is_transient_error(self, error: Exception) -> bool:
+        """Check if an error is a rate limit, server or network failure"""
+        from googleapiclient.errors import HttpError
+
+        if isinstance(error, HttpError):
+            status = error.resp.status
+            if status == 429 or status >= 500:
+                return True
+            return status == 403 and any(
+                reason in str(error)
+                for reason in ('rateLimitExceeded', 'userRateLimitExceeded')
+            )
+
+        return (
+            isinstance(error, OSError) or
+            type(error).__module__.startswith('httplib2')
+        )
 
-        except Exception as e:
-            logger.error(f'Error getting message details: {e}')
+    def _get_retry_after(self, error) -> Optional[float]:
+        """Get Retry-After seconds from an HttpError response, if any"""
+        try:
+            return float(error.resp.get('retry-after'))
+        except (TypeError, ValueError):
             return None
 
     def _extract_message_body(self, payload) -> str:
         """Extract text from message payload (both plain text and HTML)"""
-        body = ""
-
         if 'parts' in payload:
-            for part in payload['parts']:
-                if part['mimeType'] == 'text/plain' and 'data' in part['body']:
-                    data = part['body']['data']
-                    body += base64.urlsafe_b64decode(data).decode('utf-8')
-                elif part['mimeType'] == 'text/html' and 'data' in part['body']:
-                    data = part['body']['data']
-                    html_content = base64.urlsafe_b64decode(data).decode('utf-8')
+            parts = payload['parts']
+        else:
+            parts = [payload]
+
+        # Decode one part at a time and join once at the end
+        texts = []
+        for part in parts:
+            if 'data' not in part['body']:
+                continue
+            if part['mimeType'] == 'text/plain':
+                texts.append(self._decode_part(part))
+            elif part['mimeType'] == 'text/html':
+                html_content = self._decode_part(part)
+                with span('gmail.html_strip'):
                     # Extract text from HTML using simple regex
-                    import re
-                    # Remove HTML tags and get text content
-                    text_content = re.sub(r'<[^>]+>', ' ', html_content)
+                    text_content = HTML_TAG_PATTERN.sub(' ', html_content)
                     # Clean up whitespace
-                    text_content = re.sub(r'\s+', ' ', text_content).strip()
-                    body += text_content
-        elif payload['mimeType'] == 'text/plain' and 'data' in payload['body']:
-            data = payload['body']['data']
-            body = base64.urlsafe_b64decode(data).decode('utf-8')
-        elif payload['mimeType'] == 'text/html' and 'data' in payload['body']:
-            data = payload['body']['data']
-            html_content = base64.urlsafe_b64decode(data).decode('utf-8')
-            # Extract text from HTML using simple regex
-            import re
-            # Remove HTML tags and get text content
-            text_content = re.sub(r'<[^>]+>', ' ', html_content)
-            # Clean up whitespace
-            text_content = re.sub(r'\s+', ' ', text_content).strip()
-            body = text_content
-
-        return body
+                    texts.append(
+                        WHITESPACE_PATTERN.sub(' ', text_content).strip()
+                    )
+
+        return ''.join(texts)
+
+    def _decode_part(self, part: Dict) -> str:
+        """Decode the base64url body of a message part"""
+        return base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
 
     def _extract_verification_codes(self, text: str) -> List[str]:
         """Extract verification codes from text using regex patterns"""
-        patterns = [
-            r'\b\d{6}\b',  # 6-digit codes
-            # r'\b\d{4}\b',  # 4-digit codes
-            # r'\b\d{8}\b',  # 8-digit codes
-            # r'\b[A-Z0-9]{6}\b',  # 6-character alphanumeric codes
-            # r'\b[A-Z0-9]{8}\b',  # 8-character alphanumeric codes
-        ]
-
         codes = []
-        for pattern in patterns:
-            matches = re.findall(pattern, text.upper())
-            codes.extend(matches)
+        for pattern in CODE_PATTERNS:
+            # Match case-insensitively instead of uppercasing the whole text
+            codes.extend(match.upper() for match in pattern.findall(text))
 
         # Remove duplicates and filter out common false positives
         codes = list(set(codes))
@@ -343,7 +591,7 @@ class GmailService:
             return datetime.now(timezone.utc)
 
     def _is_new_message(self, message_date: datetime) -> bool:
-        """Check if message is newer than last check"""
+        """Check if message falls inside the lookback window of the last check"""
         # Ensure both datetimes are timezone-aware for comparison
         if message_date.tzinfo is None:
             message_date = message_date.replace(tzinfo=timezone.utc)
@@ -351,4 +599,4 @@ class GmailService:
         if self.last_check_time.tzinfo is None:
             self.last_check_time = self.last_check_time.replace(tzinfo=timezone.utc)
 
-        return message_date > self.last_check_time
+        return message_date > self.last_check_time - DATE_LOOKBACK_GRACE
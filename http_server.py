@@ -0,0 +1,72 @@
+import asyncio
+import time
+import logging
+from typing import Callable, Dict
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Event loop lag above which the bot is reported as not alive
+MAX_LOOP_LAG = 5.0
+
+
+class HttpServer:
+    """Embedded HTTP server for health checks and other bot endpoints.
+
+    The status provider is called per request and must return a dict with
+    boolean 'alive' and 'ready' keys plus any details to report.
+    """
+
+    def __init__(self, host: str, port: int,
+                 status_provider: Callable[[], Dict]):
+        self.host = host
+        self.port = port
+        self.status_provider = status_provider
+        self.app = web.Application()
+        self.app.router.add_get('/healthz', self.liveness)
+        self.app.router.add_get('/readyz', self.readiness)
+        self.loop_lag = 0.0
+        self._runner = None
+        self._lag_task = None
+
+    async def start(self):
+        """Start serving requests"""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self._lag_task = asyncio.create_task(self._measure_loop_lag())
+        logger.info(f"HTTP server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        """Stop serving requests"""
+        if self._lag_task:
+            self._lag_task.cancel()
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _measure_loop_lag(self, interval: float = 1.0):
+        """Track how late the event loop wakes up from a sleep"""
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(interval)
+            self.loop_lag = time.monotonic() - start - interval
+
+    def _status(self) -> Dict:
+        """Collect status including event loop responsiveness"""
+        status = self.status_provider()
+        status['loop_lag'] = round(self.loop_lag, 3)
+        status['alive'] = status['alive'] and self.loop_lag < MAX_LOOP_LAG
+        return status
+
+    async def liveness(self, request: web.Request) -> web.Response:
+        """Handle /healthz - the event loop and monitoring loop are running"""
+        status = self._status()
+        return web.json_response(status, status=200 if status['alive'] else 503)
+
+    async def readiness(self, request: web.Request) -> web.Response:
+        """Handle /readyz - Gmail and Telegram are ready to deliver codes"""
+        status = self._status()
+        ok = status['alive'] and status['ready']
+        return web.json_response(status, status=200 if ok else 503)
@@ -1,9 +1,22 @@
+import time
+
+# Reference point for time-to-first-poll, taken before heavy imports
+STARTUP_TIME = time.perf_counter()
+
 import asyncio
 import logging
 import os
+import signal
 from datetime import datetime, timezone
-from config import config
-from gmail_service import GmailService
+from typing import List, Optional
+from config import config, Config
+from config_watcher import ConfigWatcher
+from gmail_service import GmailService, VerificationMessage
+from http_server import HttpServer
+from middlewares import RoleIndex
+from profiling import Profiler
+from state_store import StateStore
+from stats import StatsBuffer, POLL, POLL_FAILED, CODES
 from telegram_service import TelegramService
 
 # Setup logging
@@ -30,25 +43,126 @@ logger = logging.getLogger(__name__)
 class GmailVerificationBot:
     def __init__(self):
         self.config = config
-        self.telegram_service = TelegramService(self.config)
+        self.stats = StatsBuffer(self.config.stats_buffer_size)
+        self.profiler = Profiler(self.config.profile_sample_rate)
+        self.telegram_service = TelegramService(self.config, stats=self.stats)
         self.gmail_service = GmailService(
             client_id=self.config.gmail_client_id,
             client_secret=self.config.gmail_client_secret,
             token_file=self.config.gmail_token_file,
             scopes=self.config.gmail_scopes,
-            telegram_service=self.telegram_service
+            telegram_service=self.telegram_service,
+            account=self.config.gmail_account,
+            quota_units_per_second=self.config.gmail_quota_units_per_second,
+            breaker_failure_threshold=self.config.gmail_breaker_failure_threshold,
+            breaker_reset_timeout=self.config.gmail_breaker_reset_timeout,
+            max_results=self.config.gmail_max_results,
+            pipeline_queue_size=self.config.pipeline_queue_size,
+            record_file=self.config.gmail_record_file,
+            replay_file=self.config.gmail_replay_file,
+            replay_latency=self.config.gmail_replay_latency_ms / 1000
+        )
+        self.telegram_service.gmail_service = self.gmail_service
+        self.config_watcher = ConfigWatcher(self.config)
+        self.config_watcher.subscribe(self.apply_config)
+        self.telegram_service.config_watcher = self.config_watcher
+        self.telegram_service.poll_trigger = self.poll_now
+        self.telegram_service.profiler = self.profiler
+        self._profile_task = None
+        self._poll_task = None
+        self._follow_up_task = None
+        self._config_changed = asyncio.Event()
+        self._startup_task = None
+        self.state_store = (
+            StateStore(self.config.state_file) if self.config.state_file else None
         )
+        # None until the checkpoint is loaded, so a failed start can't
+        # overwrite it
+        self._saved_state_version = None
+        self._shutdown_requested = asyncio.Event()
+        self._shutdown_deadline = None
+        self.time_to_first_poll = None
+        self.http_server = None
+        if self.config.http_port:
+            self.http_server = HttpServer(
+                self.config.http_host, self.config.http_port, self.health_status
+            )
+            if self.config.telegram_webhook_url:
+                self.telegram_service.setup_webhook(self.http_server.app)
+        self._last_loop_activity = time.monotonic()
         self.running = False
 
+    def apply_config(self, new_config: Config):
+        """Swap in a new config snapshot without restarting services"""
+        self.config = new_config
+        self.telegram_service.config = new_config
+        self.telegram_service.roles = RoleIndex(new_config)
+        self.telegram_service.throttle.rate_per_minute = (
+            new_config.command_rate_limit
+        )
+        self.telegram_service.throttle.burst = new_config.command_burst
+        self.gmail_service.quota.units_per_second = (
+            new_config.gmail_quota_units_per_second
+        )
+        self.gmail_service.circuit_breaker.failure_threshold = (
+            new_config.gmail_breaker_failure_threshold
+        )
+        self.gmail_service.circuit_breaker.reset_timeout = (
+            new_config.gmail_breaker_reset_timeout
+        )
+        self.gmail_service.max_results = new_config.gmail_max_results
+        self.gmail_service.pipeline_queue_size = new_config.pipeline_queue_size
+        self.profiler.sample_rate = new_config.profile_sample_rate
+        self.telegram_service.delivery_store.ttl = new_config.code_edit_window
+        # Wake the monitoring loop so a new check interval applies immediately
+        self._config_changed.set()
+
+    def health_status(self) -> dict:
+        """Report liveness, readiness and progress for health checks"""
+        now = time.monotonic()
+        # The monitoring loop is wedged if it hasn't started or finished a
+        # poll for a few intervals
+        stale_after = self.config.check_interval * 3 + 60
+        loop_fresh = now - self._last_loop_activity < stale_after
+
+        last_success = self.gmail_service.last_successful_check
+        gmail_ready = self.gmail_service.service is not None
+        telegram_ready = self.telegram_service.is_ready
+        pipeline = self.gmail_service.pipeline
+
+        shutting_down = self._shutdown_requested.is_set()
+
+        return {
+            'alive': not self.running or loop_fresh,
+            'ready': gmail_ready and telegram_ready and not shutting_down,
+            'shutting_down': shutting_down,
+            'gmail_authenticated': gmail_ready,
+            'gmail_circuit_breaker': self.gmail_service.circuit_breaker.state,
+            'telegram_session_open': telegram_ready,
+            'seconds_since_last_poll': (
+                round(now - last_success, 1) if last_success else None
+            ),
+            'queues': {
+                'telegram_pending_sends': self.telegram_service.pending_sends,
+                'telegram_coalesce_buffer': self.telegram_service.coalesce_backlog,
+                'gmail_pipeline': pipeline.queue_depths() if pipeline else {},
+            },
+        }
+
     async def initialize(self):
         """Initialize services"""
         logger.info("Initializing Gmail Verification Bot...")
 
-        # Authenticate Gmail
-        if not await self.gmail_service.authenticate():
+        # Authenticate Gmail and set up the Telegram bot concurrently
+        gmail_ok, _ = await asyncio.gather(
+            self.gmail_service.authenticate(),
+            self.telegram_service.prepare()
+        )
+        if not gmail_ok:
             raise Exception("Failed to authenticate with Gmail")
 
         logger.info("Gmail authentication successful")
+        self._restore_state()
 
         # Send startup message to admin chats
         startup_message = (
@@ -63,22 +177,104 @@ class GmailVerificationBot:
             f"✅ Ready to monitor Gmail for verification codes!"
         )
 
-        await self.telegram_service.send_status_message(startup_message)
+        # Don't hold up the first poll waiting for the notification
+        self._startup_task = asyncio.create_task(
+            self.telegram_service.send_status_message(startup_message)
+        )
         logger.info("Bot initialized successfully")
 
-    async def check_gmail(self):
-        """Check Gmail for new verification messages"""
-        try:
-            messages = await self.gmail_service.get_recent_messages(
-                self.config.verification_keywords
-            )
+    async def poll_now(self) -> Optional[List[VerificationMessage]]:
+        """Check Gmail now, or right after the check that is in flight.
 
-            if messages:
-                logger.info(f"Found {len(messages)} verification messages")
-                await self.telegram_service.send_verification_message(messages)
+        The check in flight may have listed messages before the caller's
+        email arrived, so joining it also queues one follow-up check,
+        shared by everyone who joins the same check.
+        """
+        if self._poll_task is not None and not self._poll_task.done():
+            if self._follow_up_task is None:
+                self._follow_up_task = asyncio.create_task(
+                    self._poll_after(self._poll_task)
+                )
+            # Shield so one caller going away doesn't cancel the shared check
+            return await asyncio.shield(self._follow_up_task)
 
-        except Exception as e:
-            logger.error(f"Error checking Gmail: {e}")
+        if self._shutdown_requested.is_set():
+            return []
+        self._poll_task = asyncio.create_task(self.check_gmail())
+        return await asyncio.shield(self._poll_task)
+
+    async def _poll_after(self, running: asyncio.Task
+                          ) -> Optional[List[VerificationMessage]]:
+        """Check again once a running check is done, returning both results"""
+        await asyncio.wait([running])
+        self._follow_up_task = None
+        earlier = [] if running.cancelled() else running.result()
+        if self._shutdown_requested.is_set():
+            return earlier
+        if self._poll_task is running:
+            self._poll_task = asyncio.create_task(self.check_gmail())
+        later = await asyncio.shield(self._poll_task)
+        if later is None:
+            return None
+        return (earlier or []) + later
+
+    async def check_gmail(self) -> Optional[List[VerificationMessage]]:
+        """Check Gmail for new verification messages.
+
+        Returns None if the check failed.
+        """
+        messages = []
+        with self.profiler.trace():
+            try:
+                last_success = self.gmail_service.last_successful_check
+                start = time.perf_counter()
+                if self.config.message_coalescing:
+                    # Coalesced messages are combined, so collect them first
+                    messages = await self.gmail_service.get_recent_messages(
+                        self.config.verification_keywords
+                    )
+                else:
+                    # Deliver each message as soon as it has been extracted
+                    messages = await self.gmail_service.get_recent_messages(
+                        self.config.verification_keywords,
+                        render=self.telegram_service.render_message,
+                        deliver=self.telegram_service.deliver_message
+                    )
+                poll_kind = (
+                    POLL if self.gmail_service.last_successful_check != last_success
+                    else POLL_FAILED
+                )
+                self.stats.record(
+                    poll_kind, latency=time.perf_counter() - start
+                )
+
+                if messages:
+                    logger.info(f"Found {len(messages)} verification messages")
+                    if self.config.message_coalescing:
+                        await self.telegram_service.send_verification_message(
+                            messages
+                        )
+
+                    # Lag from the email's Date header to delivery
+                    now = datetime.now(timezone.utc)
+                    for msg in messages:
+                        self.stats.record(
+                            CODES,
+                            count=len(msg.codes),
+                            latency=max(0.0, (now - msg.date).total_seconds()),
+                            detail=msg.sender
+                        )
+
+                # Messages delivered before a failure are saved all the same
+                await self._save_state_if_changed()
+                if poll_kind == POLL_FAILED:
+                    return None
+
+            except Exception as e:
+                logger.error(f"Error checking Gmail: {e}")
+                return None
+
+        return messages
 
     async def monitoring_loop(self):
         """Main monitoring loop"""
@@ -87,38 +283,71 @@ class GmailVerificationBot:
 
         while self.running:
             try:
-                await self.check_gmail()
-                await asyncio.sleep(self.config.check_interval)
+                if self.time_to_first_poll is None:
+                    self.time_to_first_poll = time.perf_counter() - STARTUP_TIME
+                    logger.info(
+                        f"First Gmail poll started "
+                        f"{self.time_to_first_poll:.2f}s after launch"
+                    )
+                self._last_loop_activity = time.monotonic()
+                await self.poll_now()
+                self._last_loop_activity = time.monotonic()
+                await self._wait_interval()
             except KeyboardInterrupt:
                 logger.info("Received keyboard interrupt, stopping...")
                 self.running = False
                 break
             except Exception as e:
                 logger.error(f"Error in monitoring loop: {e}")
-                await asyncio.sleep(self.config.check_interval)
+                await self._wait_interval()
+
+    async def _wait_interval(self):
+        """Sleep for the check interval, waking early on config reload"""
+        self._config_changed.clear()
+        try:
+            await asyncio.wait_for(
+                self._config_changed.wait(),
+                timeout=self.config.check_interval
+            )
+        except asyncio.TimeoutError:
+            pass
 
     async def run_bot_polling(self):
-        """Run Telegram bot polling in background"""
+        """Receive Telegram updates (long polling or webhook) in background"""
         try:
-            await self.telegram_service.start_polling()
+            if self.config.telegram_webhook_url:
+                await self.telegram_service.start_webhook()
+            else:
+                await self.telegram_service.start_polling()
         except Exception as e:
             logger.error(f"Error in bot polling: {e}")
 
     async def run(self):
         """Run the bot"""
         try:
+            if self.http_server:
+                await self.http_server.start()
+
             await self.initialize()
+            self._install_signal_handlers()
 
             # Create tasks for monitoring and bot polling
             monitoring_task = asyncio.create_task(self.monitoring_loop())
             polling_task = asyncio.create_task(self.run_bot_polling())
+            watcher_task = asyncio.create_task(self.config_watcher.watch())
+            shutdown_task = asyncio.create_task(self._shutdown_requested.wait())
 
-            # Wait for either task to complete (or fail)
+            # Wait for either task to complete (or fail) or a shutdown signal
             done, pending = await asyncio.wait(
-                [monitoring_task, polling_task],
+                [monitoring_task, polling_task, shutdown_task],
                 return_when=asyncio.FIRST_COMPLETED
             )
 
+            # Stop taking new polls and commands, then let in-flight work finish
+            self._begin_shutdown()
+            await self.telegram_service.stop_updates()
+            await self._drain_poll()
+
             # Cancel remaining tasks
             for task in pending:
                 task.cancel()
@@ -127,15 +356,151 @@ class GmailVerificationBot:
                 except asyncio.CancelledError:
                     pass
 
+            watcher_task.cancel()
+
         except Exception as e:
             logger.error(f"Fatal error: {e}")
         finally:
             await self.cleanup()
 
+    def _install_signal_handlers(self):
+        """Shut down on SIGTERM/SIGINT and profile on SIGUSR1 (Unix only)"""
+        loop = asyncio.get_running_loop()
+        try:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(
+                    signum, self._on_shutdown_signal, signum.name
+                )
+            loop.add_signal_handler(signal.SIGUSR1, self._on_profile_signal)
+        except (AttributeError, NotImplementedError):
+            logger.debug("Signal handlers are not supported on this platform")
+
+    def _on_shutdown_signal(self, name: str):
+        """Start a graceful shutdown; a second signal stops waiting"""
+        if self._shutdown_requested.is_set():
+            logger.warning(f"{name} received again, cancelling in-flight check")
+            if self._poll_task and not self._poll_task.done():
+                self._poll_task.cancel()
+            return
+        logger.info(
+            f"{name} received, shutting down "
+            f"(up to {self.config.shutdown_timeout}s to finish in-flight work)"
+        )
+        self._shutdown_requested.set()
+
+    def _begin_shutdown(self):
+        """Stop the monitoring loop and start the shutdown deadline"""
+        self._shutdown_requested.set()
+        self.running = False
+        if self._shutdown_deadline is None:
+            self._shutdown_deadline = (
+                time.monotonic() + self.config.shutdown_timeout
+            )
+        # Wake the monitoring loop so it exits instead of sleeping
+        self._config_changed.set()
+
+    def _shutdown_time_left(self) -> float:
+        """Seconds left before the shutdown deadline"""
+        if self._shutdown_deadline is None:
+            return float(self.config.shutdown_timeout)
+        return max(0.0, self._shutdown_deadline - time.monotonic())
+
+    async def _drain_poll(self):
+        """Let an in-flight check deliver its messages before the deadline"""
+        task = self._poll_task
+        if task is None or task.done():
+            return
+
+        logger.info("Waiting for the in-flight Gmail check to finish...")
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(task), timeout=self._shutdown_time_left()
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Shutdown deadline reached, cancelling Gmail check")
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        except asyncio.CancelledError:
+            # A second signal cancels the check; anything else propagates
+            if not task.cancelled():
+                raise
+
+    def _restore_state(self):
+        """Resume the Gmail sync state from the last checkpoint"""
+        if not self.state_store:
+            return
+        state = self.state_store.load(self.config.gmail_account)
+        if state:
+            self.gmail_service.restore(state)
+        self._saved_state_version = self.gmail_service.state_version
+
+    def _save_state(self):
+        """Checkpoint the Gmail sync state to the state file"""
+        if not self.state_store or self._saved_state_version is None:
+            return
+        try:
+            version = self.gmail_service.state_version
+            self.state_store.save(
+                self.config.gmail_account, self.gmail_service.checkpoint()
+            )
+            self._saved_state_version = version
+        except Exception as e:
+            logger.error(f"Error saving state to {self.state_store.path}: {e}")
+
+    async def _save_state_if_changed(self):
+        """Checkpoint after a check that handled new messages"""
+        if self._saved_state_version not in (
+                None, self.gmail_service.state_version):
+            await asyncio.to_thread(self._save_state)
+
+    def _on_profile_signal(self):
+        """Start a profile capture unless one is already running"""
+        if self._profile_task and not self._profile_task.done():
+            logger.warning("SIGUSR1 ignored, a profile capture is already running")
+            return
+        logger.info(
+            f"SIGUSR1 received, profiling for {self.config.profile_seconds}s"
+        )
+        self._profile_task = asyncio.create_task(self._profile_to_admins())
+
+    async def _profile_to_admins(self):
+        """Capture a profile and send the report to the admin chats"""
+        try:
+            report = await self.profiler.capture(
+                self.config.profile_seconds, workload=self.poll_now
+            )
+            await self.telegram_service.send_admin_report(
+                report,
+                f"📊 {self.config.profile_seconds}s cProfile and tracemalloc "
+                f"report (SIGUSR1)"
+            )
+        except Exception as e:
+            logger.error(f"Profile capture failed: {e}")
+
     async def cleanup(self):
         """Cleanup resources"""
         logger.info("Cleaning up...")
 
+        if self._startup_task and not self._startup_task.done():
+            self._startup_task.cancel()
+
+        # Don't drop codes still waiting for the coalescing window
+        try:
+            await asyncio.wait_for(
+                self.telegram_service.flush_coalesced(),
+                timeout=max(1.0, self._shutdown_time_left())
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Shutdown deadline reached, dropping coalesced messages")
+        except Exception as e:
+            logger.error(f"Error flushing coalesced messages: {e}")
+
+        # Let the next run resume from here instead of rescanning
+        self._save_state()
+
         # Send shutdown message
         shutdown_message = (
             f"🔴 <b>Gmail Verification Bot Stopped</b>\n\n"
@@ -150,6 +515,9 @@ class GmailVerificationBot:
             pass
 
         await self.telegram_service.close()
+        self.gmail_service.close()
+        if self.http_server:
+            await self.http_server.stop()
         logger.info("Cleanup completed")
 
 
@@ -0,0 +1,6 @@
+# Output variants of verification messages. Kept free of imports so config
+# can validate format names without loading the formatter.
+HTML = 'HTML'
+PLAIN = 'plain'
+MARKDOWN_V2 = 'MarkdownV2'
+FORMATS = (HTML, PLAIN, MARKDOWN_V2)
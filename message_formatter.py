@@ -0,0 +1,340 @@
+import html
+import re
+import logging
+from datetime import timezone
+from html.parser import HTMLParser
+from typing import (
+    TYPE_CHECKING, Dict, Iterable, List, NamedTuple, Optional, Sequence
+)
+from message_formats import HTML, PLAIN, MARKDOWN_V2
+
+if TYPE_CHECKING:
+    from gmail_service import VerificationMessage
+
+logger = logging.getLogger(__name__)
+
+PARSE_MODES = {HTML: 'HTML', PLAIN: None, MARKDOWN_V2: 'MarkdownV2'}
+
+# Telegram's maximum message length, in UTF-16 code units
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Kept free below the limit when splitting, so a chunk that is close to it
+# isn't rejected over how Telegram counts emoji and entities
+TELEGRAM_MESSAGE_HEADROOM = 96
+COALESCED_SEPARATOR = "\n\n➖➖➖➖➖\n\n"
+
+# Templates are plain str.format strings, parsed once at import
+TEMPLATES = {
+    HTML: (
+        "📧 <b>Verification Email Received</b>\n\n"
+        "📋 <b>Subject:</b> {subject}\n"
+        "🕐 <b>Time:</b> {time}"
+        "{codes}"
+    ),
+    PLAIN: (
+        "📧 Verification Email Received\n\n"
+        "Subject: {subject}\n"
+        "Time: {time}"
+        "{codes}"
+    ),
+    MARKDOWN_V2: (
+        "📧 *Verification Email Received*\n\n"
+        "📋 *Subject:* {subject}\n"
+        "🕐 *Time:* {time}"
+        "{codes}"
+    ),
+}
+
+CODES_TEMPLATES = {
+    HTML: "\n\n🔢 <b>Codes found:</b> <code>{codes}</code>",
+    PLAIN: "\n\nCodes found: {codes}",
+    MARKDOWN_V2: "\n\n🔢 *Codes found:* `{codes}`",
+}
+
+# Codes replaced by a newer email from the same sender
+EXPIRED_TEMPLATES = {
+    HTML: "\n⌛ <b>Expired:</b> <s>{codes}</s>",
+    PLAIN: "\nExpired: {codes}",
+    MARKDOWN_V2: "\n⌛ *Expired:* ~{codes}~",
+}
+
+# Tags supported by Telegram's HTML parse mode
+TELEGRAM_HTML_TAGS = {
+    'b', 'strong', 'i', 'em', 'u', 'ins', 's', 'strike', 'del', 'a', 'code',
+    'pre', 'span', 'tg-spoiler', 'tg-emoji', 'blockquote',
+}
+TELEGRAM_HTML_ENTITIES = {'lt', 'gt', 'amp', 'quot'}
+
+_MARKDOWN_V2_SPECIAL = re.compile(r'([_*\[\]()~`>#+\-=|{}.!\\])')
+# Unescaped MarkdownV2 characters that open or close an entity
+_MARKDOWN_V2_TOGGLES = ('||', '__', '*', '_', '~', '`')
+_MARKDOWN_V2_NESTING = {'[': 1, ']': -1, '(': 1, ')': -1}
+
+
+class RenderedMessage(NamedTuple):
+    text: str
+    parse_mode: Optional[str]
+
+
+def escape_markdown_v2(text: str) -> str:
+    """Escape text for Telegram MarkdownV2"""
+    return _MARKDOWN_V2_SPECIAL.sub(r'\\\1', text)
+
+
+ESCAPERS = {
+    HTML: lambda text: html.escape(text, quote=False),
+    PLAIN: lambda text: text,
+    MARKDOWN_V2: escape_markdown_v2,
+}
+
+
+class _TelegramHTMLValidator(HTMLParser):
+    """Check markup against what Telegram's HTML parser accepts"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.stack = []
+        self.valid = True
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in TELEGRAM_HTML_TAGS:
+            self.valid = False
+        self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if not self.stack or self.stack.pop() != tag:
+            self.valid = False
+
+    def handle_entityref(self, name):
+        if name not in TELEGRAM_HTML_ENTITIES:
+            self.valid = False
+
+    def handle_data(self, data):
+        if '<' in data or '>' in data or '&' in data:
+            self.valid = False
+
+
+def validate_html(text: str) -> bool:
+    """Check if text can be sent with Telegram's HTML parse mode"""
+    validator = _TelegramHTMLValidator()
+    try:
+        validator.feed(text)
+        validator.close()
+    except Exception:
+        return False
+    return validator.valid and not validator.stack and not validator.rawdata
+
+
+def utf16_length(text: str) -> int:
+    """Length of text as Telegram counts it, in UTF-16 code units"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _html_cuts(line: str):
+    """Positions in a line of Telegram HTML outside tags, entities and elements"""
+    depth = 0
+    i = 0
+    while i < len(line):
+        if line[i] == '<':
+            end = line.find('>', i)
+            if end == -1:
+                return
+            depth += -1 if line.startswith('</', i) else 1
+            i = end + 1
+        elif line[i] == '&':
+            end = line.find(';', i)
+            i = len(line) if end == -1 else end + 1
+        else:
+            i += 1
+        if depth == 0 and i < len(line):
+            yield i
+
+
+def _markdown_v2_cuts(line: str):
+    """Positions in a line of MarkdownV2 outside escapes and entities"""
+    open_toggles = set()
+    nesting = 0
+    i = 0
+    while i < len(line):
+        if line[i] == '\\':
+            i += 2
+        else:
+            toggle = next(
+                (t for t in _MARKDOWN_V2_TOGGLES if line.startswith(t, i)),
+                None
+            )
+            if toggle:
+                open_toggles ^= {toggle}
+                i += len(toggle)
+            else:
+                nesting += _MARKDOWN_V2_NESTING.get(line[i], 0)
+                i += 1
+        if not open_toggles and nesting == 0 and i < len(line):
+            yield i
+
+
+def _plain_cuts(line: str):
+    """Every position inside a line of plain text"""
+    return range(1, len(line))
+
+
+CUT_FINDERS = {
+    PARSE_MODES[HTML]: _html_cuts,
+    PARSE_MODES[MARKDOWN_V2]: _markdown_v2_cuts,
+}
+
+
+def _split_line(line: str, limit: int,
+                parse_mode: Optional[str]) -> List[str]:
+    """Split an over-long line on text boundaries, never inside markup.
+
+    Cuts go at the last space that fits, or the last position that fits
+    when there is none. Markup that can't be cut within the limit is kept
+    whole, so that chunk goes over the limit rather than breaking it.
+    """
+    find_cuts = CUT_FINDERS.get(parse_mode, _plain_cuts)
+    parts = []
+    while utf16_length(line) > limit:
+        best = space = None
+        length = previous = 0
+        for cut in find_cuts(line):
+            length += utf16_length(line[previous:cut])
+            previous = cut
+            if length > limit:
+                if best is None:
+                    best = cut
+                break
+            best = cut
+            if line[cut] == ' ':
+                space = cut
+        if best is None:
+            break
+        if space is not None:
+            parts.append(line[:space])
+            line = line[space + 1:]
+        else:
+            parts.append(line[:best])
+            line = line[best:]
+    parts.append(line)
+    return parts
+
+
+def split_message(blocks: List[str], separator: str,
+                  parse_mode: Optional[str] = None,
+                  limit: int = TELEGRAM_MESSAGE_LIMIT
+                  - TELEGRAM_MESSAGE_HEADROOM) -> List[str]:
+    """Pack blocks into as few messages as fit Telegram's length limit.
+
+    Blocks are never split unless a single block is over the limit, in
+    which case it is split on line boundaries, and a line that is still
+    too long on text boundaries outside its markup.
+    """
+    pieces = []
+    for block in blocks:
+        if utf16_length(block) <= limit:
+            pieces.append((block, separator))
+            continue
+        for line in block.split('\n'):
+            for part in _split_line(line, limit, parse_mode):
+                pieces.append((part, '\n'))
+
+    chunks = []
+    current = ''
+    current_length = 0
+    current_separator = ''
+    for piece, piece_separator in pieces:
+        length = utf16_length(piece)
+        joined_length = (
+            current_length + utf16_length(current_separator) + length
+        )
+        if not current:
+            current, current_length = piece, length
+        elif joined_length <= limit:
+            current += current_separator + piece
+            current_length = joined_length
+        else:
+            chunks.append(current)
+            current, current_length = piece, length
+        current_separator = piece_separator
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class MessageFormatter:
+    """Render verification messages once per output variant"""
+
+    def render(self, msg: 'VerificationMessage', fmt: str,
+               expired_codes: Sequence[str] = ()) -> RenderedMessage:
+        """Render a message in one variant"""
+        return self.render_variants(msg, (fmt,), expired_codes)[fmt]
+
+    def render_variants(self, msg: 'VerificationMessage',
+                        formats: Iterable[str],
+                        expired_codes: Sequence[str] = ()
+                        ) -> Dict[str, RenderedMessage]:
+        """Render a message once for each distinct variant.
+
+        HTML output that Telegram would reject is replaced by the plain
+        variant up front, so no send has to fail first.
+        """
+        subject, time_str, codes = self._fields(msg)
+        expired = ' | '.join(expired_codes)
+        rendered = {}
+        for fmt in formats:
+            escape = ESCAPERS[fmt]
+            codes_text = ''
+            if codes:
+                codes_text = CODES_TEMPLATES[fmt].format(codes=escape(codes))
+            if expired:
+                codes_text += EXPIRED_TEMPLATES[fmt].format(
+                    codes=escape(expired)
+                )
+            rendered[fmt] = RenderedMessage(
+                TEMPLATES[fmt].format(
+                    subject=escape(subject),
+                    time=escape(time_str),
+                    codes=codes_text
+                ),
+                PARSE_MODES[fmt]
+            )
+
+        if HTML in rendered and not validate_html(rendered[HTML].text):
+            logger.warning(
+                f"Invalid HTML for message {msg.id}, "
+                f"using plain text"
+            )
+            rendered[HTML] = (
+                rendered.get(PLAIN) or self.render(msg, PLAIN, expired_codes)
+            )
+        return rendered
+
+    def render_batch(self, messages: List['VerificationMessage'],
+                     fmt: str) -> List[RenderedMessage]:
+        """Render several messages as combined chunks in one variant"""
+        blocks = [self.render(msg, fmt) for msg in messages]
+        parse_mode = PARSE_MODES[fmt]
+        if any(block.parse_mode != parse_mode for block in blocks):
+            # Some HTML didn't validate: send the whole batch as plain text
+            blocks = [self.render(msg, PLAIN) for msg in messages]
+            parse_mode = None
+
+        return [
+            RenderedMessage(chunk, parse_mode)
+            for chunk in split_message(
+                [block.text for block in blocks], COALESCED_SEPARATOR,
+                parse_mode
+            )
+        ]
+
+    def _fields(self, msg: 'VerificationMessage'):
+        """Compute the variant-independent parts of a message"""
+        # Format datetime with timezone awareness
+        msg_date = msg.date
+        if msg_date.tzinfo is None:
+            msg_date = msg_date.replace(tzinfo=timezone.utc)
+
+        return (
+            msg.subject,
+            msg_date.strftime('%H:%M:%S UTC'),
+            ' | '.join(msg.codes),
+        )
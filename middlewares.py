@@ -0,0 +1,112 @@
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Buckets kept before the least recently active users are forgotten
+MAX_TRACKED_USERS = 10000
+
+
+class RoleIndex:
+    """Authorized and admin chat IDs as sets, built once per config"""
+
+    __slots__ = ('chats', 'admins')
+
+    def __init__(self, config: Config):
+        self.chats = frozenset(config.telegram_chat_ids)
+        self.admins = frozenset(config.telegram_admin_ids)
+
+
+class _Bucket:
+    """Token bucket of one user"""
+
+    __slots__ = ('tokens', 'updated_at', 'warned')
+
+    def __init__(self, tokens: float, updated_at: float):
+        self.tokens = tokens
+        self.updated_at = updated_at
+        self.warned = False
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Per-user token bucket for bot commands.
+
+    Runs before command filters, so a throttled command costs a dict lookup.
+    The first throttled command gets one short reply; the rest are dropped
+    silently until the user has tokens again. Admin chats are exempt.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int,
+                 is_exempt: Callable[[str], bool]):
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.is_exempt = is_exempt
+        # Least recently active first
+        self._buckets: 'OrderedDict[int, _Bucket]' = OrderedDict()
+        self.allowed = 0
+        self.throttled = 0
+        self.warned = 0
+
+    @property
+    def tracked_users(self) -> int:
+        """Users with a bucket, up to MAX_TRACKED_USERS"""
+        return len(self._buckets)
+
+    async def __call__(
+            self,
+            handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+            event: Message,
+            data: Dict[str, Any]
+    ) -> Any:
+        # Only commands are handled; other messages pass through untouched
+        if self.rate_per_minute <= 0 or not (event.text or '').startswith('/'):
+            return await handler(event, data)
+        if self.is_exempt(str(event.chat.id)):
+            self.allowed += 1
+            return await handler(event, data)
+
+        user_id = event.from_user.id if event.from_user else event.chat.id
+        if self._take(user_id):
+            self.allowed += 1
+            return await handler(event, data)
+
+        self.throttled += 1
+        bucket = self._buckets[user_id]
+        if not bucket.warned:
+            bucket.warned = True
+            self.warned += 1
+            logger.warning(f"Throttling commands from user {user_id}")
+            try:
+                await event.answer("⏳ Too many commands, please slow down.")
+            except Exception as e:
+                logger.debug(f"Could not send throttle notice: {e}")
+        return None
+
+    def _take(self, user_id: int) -> bool:
+        """Spend a token for a user's command if one is available"""
+        now = time.monotonic()
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            while len(self._buckets) >= MAX_TRACKED_USERS:
+                # The idlest user, whose bucket has most likely refilled
+                self._buckets.popitem(last=False)
+            bucket = self._buckets[user_id] = _Bucket(self.burst, now)
+        else:
+            self._buckets.move_to_end(user_id)
+            bucket.tokens = min(
+                self.burst,
+                bucket.tokens
+                + (now - bucket.updated_at) * self.rate_per_minute / 60
+            )
+            bucket.updated_at = now
+
+        if bucket.tokens < 1:
+            return False
+        bucket.tokens -= 1
+        bucket.warned = False
+        return True
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Offline Replay Tool
+Run an mbox file or a directory of .eml files through the same body
+extraction and code detection the bot uses on Gmail messages, to tune
+keywords and code patterns without waiting for real emails.
+
+Messages are converted to Gmail API payloads and processed by
+GmailService's decode and extract stages across all cores. With a labels
+file, precision and recall of the detected codes are reported.
+
+Usage:
+    python offline_replay.py CORPUS [--labels labels.json]
+        [--keywords verification,code] [--all] [--workers N]
+        [--per-message] [--show-errors 10]
+
+Labels map a file name (or "<mbox name>#<index>" for mbox messages) or a
+Message-ID to the codes expected in that message:
+    {"welcome.eml": ["123456"], "<abc@example.com>": []}
+"""
+
+import argparse
+import base64
+import email
+import email.policy
+import json
+import mailbox
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from gmail_service import GmailService
+
+# Same default as VERIFICATION_KEYWORDS in config.py, which can't be
+# imported here without the bot's required environment variables
+DEFAULT_KEYWORDS = 'verification,code,verify,2FA,two-factor,OTP,one-time'
+
+# Messages sent to a worker process at a time
+BATCH_SIZE = 32
+
+
+class ReplayResult(NamedTuple):
+    name: str
+    message_id: str
+    subject: str
+    matched: bool
+    codes: List[str]
+    seconds: float
+    error: Optional[str]
+
+
+def iter_corpus(path: str) -> Iterator[Tuple[str, bytes]]:
+    """Yield (name, raw bytes) for each message in an mbox, .eml or directory"""
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.eml'):
+                with open(os.path.join(path, name), 'rb') as f:
+                    yield name, f.read()
+    elif path.endswith('.eml'):
+        with open(path, 'rb') as f:
+            yield os.path.basename(path), f.read()
+    else:
+        mbox = mailbox.mbox(path, create=False)
+        base = os.path.basename(path)
+        for index, key in enumerate(mbox.iterkeys()):
+            yield f'{base}#{index}', mbox.get_bytes(key)
+
+
+def to_gmail_message(message_id: str, msg: email.message.Message) -> Dict:
+    """Convert a parsed email to the shape of a Gmail API 'full' message"""
+    return {'id': message_id, 'payload': _to_gmail_payload(msg)}
+
+
+def _to_gmail_payload(part: email.message.Message) -> Dict:
+    """Convert a MIME part, recursing into multipart containers"""
+    payload = {
+        'mimeType': part.get_content_type(),
+        'headers': [
+            {'name': name, 'value': str(value)} for name, value in part.items()
+        ],
+        'body': {},
+    }
+    if part.is_multipart():
+        payload['parts'] = [_to_gmail_payload(sub) for sub in part.get_payload()]
+    else:
+        # Gmail returns the transfer-decoded bytes as base64url
+        data = part.get_payload(decode=True)
+        if data:
+            payload['body']['data'] = base64.urlsafe_b64encode(data).decode()
+    return payload
+
+
+_gmail: Optional[GmailService] = None
+_keyword_pattern: Optional[re.Pattern] = None
+
+
+def _init_worker(keywords: Optional[List[str]]):
+    """Set up the per-process GmailService used for extraction"""
+    global _gmail, _keyword_pattern
+    # No credentials are loaded: only the decode/extract stages are used
+    _gmail = GmailService('', '', os.devnull, [])
+    # Treat every message as new, whatever its Date header says
+    _gmail.last_check_time = datetime.min.replace(tzinfo=timezone.utc)
+    _keyword_pattern = None
+    if keywords:
+        # Gmail's subject: search matches whole words, case-insensitively
+        _keyword_pattern = re.compile(
+            '|'.join(rf'\b{re.escape(keyword)}\b' for keyword in keywords),
+            re.IGNORECASE
+        )
+
+
+def replay_message(name: str, raw: bytes) -> ReplayResult:
+    """Parse one message and run it through the decode and extract stages"""
+    start = time.perf_counter()
+    msg = email.message_from_bytes(raw, policy=email.policy.default)
+    message_id = str(msg.get('Message-ID', '')).strip()
+    subject = str(msg.get('Subject', ''))
+    matched = _keyword_pattern is None or bool(_keyword_pattern.search(subject))
+
+    codes, error = [], None
+    if matched:
+        try:
+            decoded = _gmail._decode_message(to_gmail_message(name, msg))
+            record = _gmail._extract_message(decoded)
+            codes = record.codes if record else []
+        except Exception as e:
+            # The live pipeline logs and skips messages that fail to decode
+            error = f'{type(e).__name__}: {e}'
+
+    return ReplayResult(
+        name, message_id, subject, matched, sorted(codes),
+        time.perf_counter() - start, error
+    )
+
+
+def replay_batch(batch: List[Tuple[str, bytes]]) -> List[ReplayResult]:
+    """Replay a batch of messages in a worker process"""
+    return [replay_message(name, raw) for name, raw in batch]
+
+
+def _batches(items: Iterable, size: int) -> Iterator[List]:
+    """Group items into lists of up to size items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def replay(corpus: Iterable[Tuple[str, bytes]], keywords: Optional[List[str]],
+           workers: int) -> Iterator[ReplayResult]:
+    """Replay messages in order, keeping only a few batches in flight"""
+    if workers <= 1:
+        _init_worker(keywords)
+        for name, raw in corpus:
+            yield replay_message(name, raw)
+        return
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(keywords,)) as executor:
+        pending = deque()
+        for batch in _batches(corpus, BATCH_SIZE):
+            pending.append(executor.submit(replay_batch, batch))
+            if len(pending) >= workers * 4:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def load_labels(path: str) -> Dict[str, List[str]]:
+    """Load expected codes keyed by file name or Message-ID"""
+    with open(path) as f:
+        labels = json.load(f)
+    return {
+        key: [codes] if isinstance(codes, str) else list(codes)
+        for key, codes in labels.items()
+    }
+
+
+def find_label(labels: Dict[str, List[str]],
+               result: ReplayResult) -> Optional[List[str]]:
+    """Expected codes for a message, or None if it isn't labeled"""
+    for key in (result.name, result.message_id, result.message_id.strip('<>')):
+        if key and key in labels:
+            return labels[key]
+    return None
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    index = max(0, min(len(values) - 1, round(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+def _ratio(numerator: int, denominator: int) -> str:
+    """Format a ratio, or n/a when it is undefined"""
+    return f'{numerator / denominator:.3f}' if denominator else 'n/a'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('corpus', help='mbox file, .eml file or directory of .eml files')
+    parser.add_argument('--labels', help='JSON file of expected codes per message')
+    parser.add_argument('--keywords',
+                        default=os.getenv('VERIFICATION_KEYWORDS', DEFAULT_KEYWORDS),
+                        help='comma-separated subject keywords (default: '
+                             'VERIFICATION_KEYWORDS or the bot default)')
+    parser.add_argument('--all', action='store_true',
+                        help='extract codes from every message, ignoring keywords')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (1 runs in this process)')
+    parser.add_argument('--per-message', action='store_true',
+                        help='print timing and codes for every message')
+    parser.add_argument('--show-errors', type=int, default=10,
+                        help='labeled messages with wrong codes to list')
+    args = parser.parse_args()
+
+    keywords = None if args.all else [
+        keyword.strip() for keyword in args.keywords.split(',') if keyword.strip()
+    ]
+    labels = load_labels(args.labels) if args.labels else None
+
+    timings = []
+    matched = decode_errors = labeled = 0
+    true_positives = false_positives = false_negatives = 0
+    mismatches = []
+
+    start = time.perf_counter()
+    for result in replay(iter_corpus(args.corpus), keywords, args.workers):
+        timings.append((result.seconds, result.name))
+        matched += result.matched
+        decode_errors += result.error is not None
+
+        if args.per_message:
+            status = result.error or ('no keyword' if not result.matched
+                                      else ', '.join(result.codes) or '-')
+            print(f"{result.seconds * 1000:8.2f} ms  {result.name}  {status}")
+
+        expected = find_label(labels, result) if labels is not None else None
+        if expected is None:
+            continue
+        labeled += 1
+        found, wanted = set(result.codes), set(expected)
+        true_positives += len(found & wanted)
+        false_positives += len(found - wanted)
+        false_negatives += len(wanted - found)
+        if found != wanted:
+            mismatches.append((result, sorted(wanted)))
+    elapsed = time.perf_counter() - start
+
+    total = len(timings)
+    if not total:
+        print("No messages found.")
+        sys.exit(1)
+
+    seconds = sorted(seconds for seconds, _ in timings)
+    print(f"\n📬 Replayed {total} messages in {elapsed:.2f}s "
+          f"({total / elapsed:.0f} msg/s, {args.workers} worker(s))")
+    if keywords:
+        print(f"🔍 Keyword matches: {matched}/{total}")
+    print(f"⚠️ Decode errors: {decode_errors}")
+    print(
+        f"⏱️ Per message: mean {sum(seconds) / total * 1000:.2f} ms, "
+        f"p50 {_percentile(seconds, 50) * 1000:.2f} ms, "
+        f"p95 {_percentile(seconds, 95) * 1000:.2f} ms, "
+        f"max {seconds[-1] * 1000:.2f} ms"
+    )
+    print("🐢 Slowest:")
+    for seconds_taken, name in sorted(timings, reverse=True)[:5]:
+        print(f"   {seconds_taken * 1000:8.2f} ms  {name}")
+
+    if labels is None:
+        return
+
+    print(f"\n🏷️ Labeled messages: {labeled}/{total}")
+    print(f"   True positives: {true_positives}, "
+          f"false positives: {false_positives}, "
+          f"false negatives: {false_negatives}")
+    print(f"   Precision: {_ratio(true_positives, true_positives + false_positives)}"
+          f"  Recall: {_ratio(true_positives, true_positives + false_negatives)}")
+
+    if mismatches and args.show_errors:
+        print(f"\n❌ Mismatches ({len(mismatches)}):")
+        for result, expected in mismatches[:args.show_errors]:
+            print(f"   {result.name}: expected {expected}, found {result.codes}"
+                  f"{' (' + result.error + ')' if result.error else ''}"
+                  f"{' (no keyword match)' if not result.matched else ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Queues sit between consecutive stages, named after the stage they feed
+QUEUES = ('decode', 'extract', 'format', 'deliver')
+
+# Marks the end of the stream on a stage queue
+_DONE = object()
+
+
+class MessagePipeline:
+    """Stream messages through fetch → decode → extract → format → deliver.
+
+    Stages are connected by bounded queues, so a burst of emails only ever
+    has a few messages in memory: fetching waits until the slower stages
+    catch up. Errors in decode/extract/format/deliver skip that message.
+    An error from fetch stops the stream once everything already fetched
+    has been delivered, and is then re-raised.
+    """
+
+    def __init__(self,
+                 fetch: Callable[[str], Awaitable[Optional[Any]]],
+                 decode: Callable[[Any], Optional[Any]],
+                 extract: Callable[[Any], Optional[Any]],
+                 render: Optional[Callable[[Any], Any]] = None,
+                 deliver: Optional[Callable[[Any, Any], Awaitable]] = None,
+                 queue_size: int = 4):
+        self.fetch = fetch
+        self.decode = decode
+        self.extract = extract
+        self.render = render
+        self.deliver = deliver
+        self.queue_size = max(1, queue_size)
+        self._queues: Dict[str, asyncio.Queue] = {}
+
+    def queue_depths(self) -> Dict[str, int]:
+        """Messages waiting in front of each stage"""
+        return {
+            name: queue.qsize() if (queue := self._queues.get(name)) else 0
+            for name in QUEUES
+        }
+
+    async def run(self, message_ids: Iterable[str]) -> List[Any]:
+        """Process messages by ID; returns the extracted records"""
+        self._queues = {
+            name: asyncio.Queue(self.queue_size) for name in QUEUES
+        }
+        queues = self._queues
+        results = []
+        outcomes = await asyncio.gather(
+            self._fetch_stage(message_ids, queues['decode']),
+            self._map_stage(
+                'decode', self.decode, queues['decode'], queues['extract']
+            ),
+            self._map_stage(
+                'extract', self.extract, queues['extract'], queues['format']
+            ),
+            self._map_stage(
+                'format', self._render, queues['format'], queues['deliver']
+            ),
+            self._deliver_stage(queues['deliver'], results),
+            return_exceptions=True
+        )
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                raise outcome
+        return results
+
+    def _render(self, record) -> tuple:
+        """Pair a record with its rendered form for delivery"""
+        return record, self.render(record) if self.render else None
+
+    async def _fetch_stage(self, message_ids: Iterable[str],
+                           outbox: asyncio.Queue):
+        """Fetch raw messages, blocking while the next stage is full"""
+        try:
+            for message_id in message_ids:
+                raw = await self.fetch(message_id)
+                if raw is not None:
+                    await outbox.put(raw)
+                    raw = None
+        except Exception:
+            await outbox.put(_DONE)
+            raise
+        await outbox.put(_DONE)
+
+    async def _map_stage(self, name: str, func: Callable[[Any], Any],
+                         inbox: asyncio.Queue, outbox: asyncio.Queue):
+        """Apply a synchronous stage to each message"""
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                break
+            try:
+                result = func(item)
+            except Exception as e:
+                logger.error(f"Pipeline {name} stage failed: {e}")
+                continue
+            # Drop the input before waiting on a full queue
+            item = None
+            if result is not None:
+                await outbox.put(result)
+                result = None
+        await outbox.put(_DONE)
+
+    async def _deliver_stage(self, inbox: asyncio.Queue, results: List[Any]):
+        """Deliver rendered messages and collect the records"""
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                break
+            record, rendered = item
+            item = None
+            if self.deliver:
+                try:
+                    await self.deliver(record, rendered)
+                except Exception as e:
+                    logger.error(f"Pipeline deliver stage failed: {e}")
+            results.append(record)
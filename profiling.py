@@ -0,0 +1,204 @@
+import asyncio
+import cProfile
+import io
+import pstats
+import random
+import time
+import tracemalloc
+import logging
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Upper bound for a single cProfile/tracemalloc capture
+MAX_PROFILE_SECONDS = 300
+
+# Trace of the poll running in the current task (None when not sampled)
+_current_trace: ContextVar[Optional['Trace']] = ContextVar(
+    'profiling_trace', default=None
+)
+_NO_SPAN = nullcontext()
+
+
+class Trace:
+    """Span timings collected during one sampled poll"""
+
+    __slots__ = ('name', 'started', 'duration', 'spans')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.time()
+        self.duration = 0.0
+        # span name -> [calls, total seconds, max seconds]
+        self.spans: Dict[str, List[float]] = {}
+
+    def add(self, name: str, elapsed: float):
+        """Account one timed span"""
+        entry = self.spans.get(name)
+        if entry is None:
+            self.spans[name] = [1, elapsed, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+
+
+class _Span:
+    """Context manager that adds its duration to a trace"""
+
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.trace.add(self.name, time.perf_counter() - self.start)
+
+
+def span(name: str):
+    """Time a block as part of the current poll's trace, if it is sampled.
+
+    Unsampled polls get a shared no-op context manager, so spans cost one
+    context variable lookup.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name)
+
+
+class Profiler:
+    """Sampled per-stage poll timings and on-demand profile captures"""
+
+    def __init__(self, sample_rate: float = 0.1, history: int = 50,
+                 top_n: int = 25):
+        self.sample_rate = sample_rate
+        self.top_n = top_n
+        self.traces: deque = deque(maxlen=history)
+        self.polls = 0
+        self.capturing = False
+        self._force_sampling = False
+
+    @contextmanager
+    def trace(self, name: str = 'poll'):
+        """Collect spans for this poll if it is sampled"""
+        self.polls += 1
+        if not (self._force_sampling or random.random() < self.sample_rate):
+            yield None
+            return
+
+        trace = Trace(name)
+        token = _current_trace.set(trace)
+        start = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            trace.duration = time.perf_counter() - start
+            _current_trace.reset(token)
+            self.traces.append(trace)
+
+    def format_timings(self) -> str:
+        """Aggregate span timings over the sampled polls as a table"""
+        traces = list(self.traces)
+        if not traces:
+            return (
+                f"No sampled polls yet ({self.polls} polls, "
+                f"sample rate {self.sample_rate:.0%})."
+            )
+
+        spans: Dict[str, List[float]] = {}
+        for trace in traces:
+            for name, (calls, total, longest) in trace.spans.items():
+                entry = spans.setdefault(name, [0, 0.0, 0.0])
+                entry[0] += calls
+                entry[1] += total
+                entry[2] = max(entry[2], longest)
+
+        poll_total = sum(trace.duration for trace in traces)
+        lines = [
+            f"{len(traces)} sampled polls of {self.polls} "
+            f"(sample rate {self.sample_rate:.0%})",
+            f"Poll time: mean {poll_total / len(traces) * 1000:.1f} ms, "
+            f"max {max(trace.duration for trace in traces) * 1000:.1f} ms",
+            "Stages overlap in the pipeline, so shares can exceed 100%.",
+            "",
+            f"{'span':<20} {'calls':>6} {'ms/poll':>9} {'mean ms':>8} "
+            f"{'max ms':>8} {'share':>6}",
+        ]
+        for name, (calls, total, longest) in sorted(
+                spans.items(), key=lambda item: item[1][1], reverse=True):
+            lines.append(
+                f"{name:<20} {calls:>6} {total / len(traces) * 1000:>9.1f} "
+                f"{total / calls * 1000:>8.2f} {longest * 1000:>8.1f} "
+                f"{total / poll_total if poll_total else 0:>6.0%}"
+            )
+        return '\n'.join(lines)
+
+    async def capture(self, seconds: float,
+                      workload: Optional[Callable[[], Awaitable]] = None) -> str:
+        """Profile the event loop thread for a while and return a report.
+
+        Every poll during the capture is traced. The workload (e.g. a
+        Gmail check) is started once profiling is on so the report is
+        never empty.
+        """
+        if self.capturing:
+            raise RuntimeError("A profile capture is already running")
+        seconds = max(1.0, min(seconds, MAX_PROFILE_SECONDS))
+
+        self.capturing = True
+        self._force_sampling = True
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        started_at = datetime.now(timezone.utc)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            if workload:
+                task = asyncio.ensure_future(workload())
+                task.add_done_callback(
+                    lambda t: t.cancelled() or t.exception()
+                )
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+            self._force_sampling = False
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            self.capturing = False
+
+        buffer = io.StringIO()
+        buffer.write(
+            f"Profile captured {started_at:%Y-%m-%d %H:%M:%S} UTC "
+            f"for {seconds:.0f}s (event loop thread only)\n\n"
+        )
+        buffer.write("== Stage timings ==\n")
+        buffer.write(self.format_timings() + "\n\n")
+
+        for sort_key in ('cumulative', 'tottime'):
+            buffer.write(f"== cProfile: top {self.top_n} by {sort_key} ==\n")
+            stats = pstats.Stats(profile, stream=buffer)
+            stats.strip_dirs().sort_stats(sort_key).print_stats(self.top_n)
+
+        buffer.write(
+            f"== tracemalloc: top {self.top_n} allocation changes ==\n"
+            f"Traced memory: {current / 1024:.0f} KiB now, "
+            f"{peak / 1024:.0f} KiB peak\n"
+        )
+        for stat in after.compare_to(before, 'lineno')[:self.top_n]:
+            buffer.write(f"{stat}\n")
+
+        logger.info(f"Captured {seconds:.0f}s profile")
+        return buffer.getvalue()
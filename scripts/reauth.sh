@@ -27,7 +27,7 @@ if [ ! -z "$1" ]; then
     echo "GMAIL_AUTH_CODE=$1" > .env.auth
     
     echo "🚀 Starting container with auth code..."
-    docker compose --env-file .env --env-file .env.auth up -d
+    docker compose --env-file config/.env --env-file .env.auth up -d
     
     # Wait for authentication
     echo "⏳ Waiting for authentication to complete..."
@@ -0,0 +1,59 @@
+import json
+import os
+import tempfile
+import logging
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+STATE_VERSION = 1
+
+
+class StateStore:
+    """Versioned JSON checkpoint of the Gmail sync state keyed by account.
+
+    Holds what a restart needs to pick up where the last run stopped: the
+    last check time and the IDs of messages already handled. Writes are
+    atomic, so a crash mid-write leaves the previous checkpoint in place.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self, account: str) -> Optional[Dict]:
+        """Load the checkpoint for an account, or None if there is none"""
+        if not os.path.exists(self.path):
+            return None
+
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            return data.get('accounts', {}).get(account)
+        except (OSError, ValueError, AttributeError) as e:
+            # A bad checkpoint only costs a rescan, so don't fail startup
+            logger.warning(f"Ignoring unreadable state file {self.path}: {e}")
+            return None
+
+    def save(self, account: str, state: Dict):
+        """Atomically write the checkpoint for an account"""
+        accounts = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    accounts = json.load(f).get('accounts', {})
+            except (OSError, ValueError, AttributeError):
+                pass
+        accounts[account] = state
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.state-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': STATE_VERSION, 'accounts': accounts}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
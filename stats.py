@@ -0,0 +1,120 @@
+import time
+from typing import Dict, List, Optional
+
+# Event kinds
+POLL = 'poll'
+POLL_FAILED = 'poll_failed'
+CODES = 'codes'
+DELIVERY = 'delivery'
+DELIVERY_FAILED = 'delivery_failed'
+EDIT = 'edit'
+KINDS = (POLL, POLL_FAILED, CODES, DELIVERY, DELIVERY_FAILED, EDIT)
+
+
+class EventRecord:
+    """A single bot event stored in the stats ring buffer"""
+
+    __slots__ = ('timestamp', 'kind', 'count', 'latency', 'detail')
+
+    def __init__(self, timestamp: float, kind: str, count: int,
+                 latency: float, detail: str):
+        self.timestamp = timestamp
+        self.kind = kind
+        self.count = count
+        self.latency = latency
+        self.detail = detail
+
+
+class StatsBuffer:
+    """Fixed-size ring buffer of recent events with incremental aggregates.
+
+    Lifetime totals and per-kind sums over the events still in the buffer
+    are updated on every insert/eviction, so summaries are O(1).
+    """
+
+    def __init__(self, capacity: int = 500):
+        self.capacity = capacity
+        self.started_at = time.time()
+        self._records: List[Optional[EventRecord]] = [None] * capacity
+        self._next = 0
+        self._size = 0
+
+        self.totals = dict.fromkeys(KINDS, 0)
+        self.max_latency = dict.fromkeys(KINDS, 0.0)
+        self.last: Dict[str, Optional[EventRecord]] = dict.fromkeys(KINDS)
+        self._window_events = dict.fromkeys(KINDS, 0)
+        self._window_count = dict.fromkeys(KINDS, 0)
+        self._window_latency = dict.fromkeys(KINDS, 0.0)
+
+    def record(self, kind: str, count: int = 1, latency: float = 0.0,
+               detail: str = ''):
+        """Add an event, evicting the oldest one if the buffer is full"""
+        record = EventRecord(time.time(), kind, count, latency, detail)
+
+        evicted = self._records[self._next]
+        if evicted is not None:
+            self._window_events[evicted.kind] -= 1
+            self._window_count[evicted.kind] -= evicted.count
+            self._window_latency[evicted.kind] -= evicted.latency
+        else:
+            self._size += 1
+
+        self._records[self._next] = record
+        self._next = (self._next + 1) % self.capacity
+
+        self._window_events[kind] += 1
+        self._window_count[kind] += count
+        self._window_latency[kind] += latency
+        self.totals[kind] += count
+        self.max_latency[kind] = max(self.max_latency[kind], latency)
+        self.last[kind] = record
+
+    def _oldest(self) -> Optional[EventRecord]:
+        """Oldest event still in the buffer"""
+        if self._size < self.capacity:
+            return self._records[0]
+        return self._records[self._next]
+
+    def average_latency(self, kind: str) -> float:
+        """Average latency of a kind of event over the buffer window"""
+        events = self._window_events[kind]
+        return self._window_latency[kind] / events if events else 0.0
+
+    def rate_per_minute(self, kind: str) -> float:
+        """Event count per minute over the buffer window"""
+        oldest = self._oldest()
+        if oldest is None:
+            return 0.0
+        span = max(time.time() - oldest.timestamp, 1.0)
+        return self._window_count[kind] * 60 / span
+
+    def seconds_since(self, kind: str) -> Optional[float]:
+        """Seconds since the last event of a kind, or None if never"""
+        record = self.last[kind]
+        return time.time() - record.timestamp if record else None
+
+    def summary(self) -> Dict:
+        """Aggregated stats for reporting"""
+        oldest = self._oldest()
+        return {
+            'uptime': time.time() - self.started_at,
+            'totals': dict(self.totals),
+            'window_events': self._size,
+            'window_seconds': time.time() - oldest.timestamp if oldest else 0.0,
+            'avg_poll_latency': self.average_latency(POLL),
+            'max_poll_latency': self.max_latency[POLL],
+            'avg_delivery_latency': self.average_latency(DELIVERY),
+            'avg_code_lag': self.average_latency(CODES),
+            'codes_per_minute': self.rate_per_minute(CODES),
+            'deliveries_per_minute': self.rate_per_minute(DELIVERY),
+            'seconds_since_poll': self.seconds_since(POLL),
+            'seconds_since_failed_poll': self.seconds_since(POLL_FAILED),
+        }
+
+    def recent(self, limit: int = 10) -> List[EventRecord]:
+        """Most recent events, newest first"""
+        limit = min(limit, self._size)
+        return [
+            self._records[(self._next - i) % self.capacity]
+            for i in range(1, limit + 1)
+        ]
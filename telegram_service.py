@@ -1,30 +1,82 @@
 import asyncio
 import logging
 import html
-from datetime import timezone
-from typing import List, Dict
+import time
+from datetime import datetime, timezone
+from typing import List, Dict, Optional
 from aiogram import Bot, Dispatcher
-from aiogram.filters import Command
-from aiogram.types import Message
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject
+from aiogram.types import BufferedInputFile, Message
+from aiohttp import web
 from config import Config
+from delivery_store import DeliveryStore
+from gmail_service import VerificationMessage
+from message_formatter import MessageFormatter, RenderedMessage, validate_html
+from middlewares import RoleIndex, ThrottlingMiddleware
+from profiling import span, MAX_PROFILE_SECONDS
+from stats import StatsBuffer, POLL, POLL_FAILED, DELIVERY, DELIVERY_FAILED, EDIT
 
 logger = logging.getLogger(__name__)
 
+# Outcomes of delivering a message to one chat
+SENT = 'sent'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
 
 class TelegramService:
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, stats: StatsBuffer = None):
         self.config = config
         self.bot = Bot(token=config.telegram_bot_token)
         self.dp = Dispatcher()
+        self.formatter = MessageFormatter()
+        self.stats = stats or StatsBuffer(config.stats_buffer_size)
+        # Rebuilt by the bot on config reload
+        self.roles = RoleIndex(config)
+        self.throttle = ThrottlingMiddleware(
+            config.command_rate_limit, config.command_burst,
+            is_exempt=self.is_admin
+        )
+        # Set by the bot when hot config reload is available
+        self.config_watcher = None
+        # Set by the bot for Gmail quota reporting
+        self.gmail_service = None
+        # Set by the bot to trigger an immediate (shared) Gmail check
+        self.poll_trigger = None
+        # Set by the bot for stage timings and profile captures
+        self.profiler = None
+        # Sends still waiting in the current fan-out
+        self.pending_sends = 0
+        self.is_ready = False
+        # Recent messages per (sender, chat) that newer codes edit in place
+        self.delivery_store = DeliveryStore(config.code_edit_window)
+        # Messages waiting for the coalescing window to close
+        self._coalesce_buffer: List[VerificationMessage] = []
+        self._coalesce_task = None
+        self._webhook_stopped = None
         self._setup_handlers()
 
     def _setup_handlers(self):
         """Setup message handlers"""
+        self.dp.startup.register(self._on_startup)
+        self.dp.message.outer_middleware(self.throttle)
         self.dp.message.register(self.start_command, Command("start"))
         self.dp.message.register(self.help_command, Command("help"))
         self.dp.message.register(self.status_command, Command("status"))
+        self.dp.message.register(self.check_command, Command("check"))
         self.dp.message.register(self.chats_command, Command("chats"))
         self.dp.message.register(self.admin_command, Command("admin"))
+        self.dp.message.register(self.reload_command, Command("reload"))
+        self.dp.message.register(self.quota_command, Command("quota"))
+        self.dp.message.register(self.stats_command, Command("stats"))
+        self.dp.message.register(self.recent_command, Command("recent"))
+        self.dp.message.register(self.timings_command, Command("timings"))
+        self.dp.message.register(self.profile_command, Command("profile"))
+
+    async def _on_startup(self):
+        """Mark the bot ready once dispatcher polling has started"""
+        self.is_ready = True
 
     async def start_command(self, message: Message):
         """Handle /start command"""
@@ -36,8 +88,15 @@ class TelegramService:
             "/start - Show this message\n"
             "/help - Show help information\n"
             "/status - Check bot status\n"
+            "/check - Check Gmail for new codes now\n"
             "/chats - List configured chat IDs (admin only)\n"
-            "/admin - Admin panel (admin only)"
+            "/admin - Admin panel (admin only)\n"
+            "/reload - Reload configuration (admin only)\n"
+            "/quota - Gmail API quota usage (admin only)\n"
+            "/stats - Delivery statistics (admin only)\n"
+            "/recent - Recent bot activity (admin only)\n"
+            "/timings - Per-stage check timings (admin only)\n"
+            "/profile [seconds] - Capture a profile (admin only)"
         )
         await message.answer(welcome_text)
 
@@ -62,22 +121,96 @@ class TelegramService:
             "/start - Welcome message\n"
             "/help - This help message\n"
             "/status - Bot status\n"
+            "/check - Check Gmail for new codes now\n"
             "/chats - List configured chat IDs (admin only)\n"
-            "/admin - Admin panel (admin only)"
+            "/admin - Admin panel (admin only)\n"
+            "/reload - Reload configuration (admin only)\n"
+            "/quota - Gmail API quota usage (admin only)\n"
+            "/stats - Delivery statistics (admin only)\n"
+            "/recent - Recent bot activity (admin only)\n"
+            "/timings - Per-stage check timings (admin only)\n"
+            "/profile [seconds] - Capture a profile (admin only)"
         )
         await message.answer(help_text)
 
+    def _bot_status(self) -> str:
+        """Describe bot health from recent poll activity"""
+        since_poll = self.stats.seconds_since(POLL)
+        if since_poll is None:
+            if self.stats.seconds_since(POLL_FAILED) is None:
+                return "⚪ Starting"
+            return "🟡 Degraded (Gmail checks failing)"
+        if since_poll > self.config.check_interval * 3 + 60:
+            return "🟡 Degraded (Gmail checks failing)"
+        return "🟢 Active"
+
     async def status_command(self, message: Message):
         """Handle /status command"""
+        since_poll = self.stats.seconds_since(POLL)
+        last_check = f"{since_poll:.0f}s ago" if since_poll is not None else "never"
         status_text = (
-            "🟢 Bot Status: Active\n\n"
+            f"Bot Status: {self._bot_status()}\n\n"
             f"📧 Gmail monitoring: Enabled\n"
+            f"🕐 Last successful check: {last_check}\n"
             f"⏱️ Check interval: {self.config.check_interval}s\n"
             f"💬 Target chats: {len(self.config.telegram_chat_ids)}\n"
             f"🔍 Keywords: {len(self.config.verification_keywords)} configured"
         )
         await message.answer(status_text)
 
+    async def check_command(self, message: Message):
+        """Handle /check command - check Gmail immediately"""
+        chat_id = str(message.chat.id)
+        if not (self.is_authorized_chat(chat_id) or self.is_admin(chat_id)):
+            await message.answer(
+                "❌ You're not authorized to use this command. "
+                "This command is only available to configured chats."
+            )
+            return
+
+        if not self.poll_trigger:
+            await message.answer("⚠️ On-demand checks are not available.")
+            return
+
+        breaker = self.gmail_service.circuit_breaker if self.gmail_service else None
+        if breaker and breaker.state == breaker.OPEN:
+            await message.answer(
+                "⚠️ Gmail checks are paused after repeated API errors. "
+                f"Retrying in {breaker.seconds_until_retry():.0f}s."
+            )
+            return
+
+        # Concurrent /check calls and a running scheduled check share one poll
+        messages = await self.poll_trigger()
+        if messages is None:
+            await message.answer(
+                "❌ Gmail check failed, see the bot log for details. "
+                "The next scheduled check will retry."
+            )
+            return
+        if not messages:
+            await message.answer("📭 No new verification emails.")
+            return
+
+        if self.is_authorized_chat(chat_id):
+            if self.coalesce_backlog:
+                # Held back with any that follow until the window closes
+                await message.answer(
+                    f"✅ Found {len(messages)} new verification email(s), "
+                    f"sending them within {self.config.coalesce_window}s."
+                )
+                return
+            # Already delivered to this chat with the regular fan-out
+            await message.answer(
+                f"✅ Found {len(messages)} new verification email(s), "
+                f"delivered above."
+            )
+            return
+
+        fmt = self._chat_format(chat_id)
+        for msg in messages:
+            await self._send_rendered(chat_id, self.formatter.render(msg, fmt))
+
     async def chats_command(self, message: Message):
         """Handle /chats command - show configured chat IDs (admin only)"""
         if not self.is_admin(str(message.chat.id)):
@@ -125,7 +258,7 @@ class TelegramService:
 
         admin_text = (
             "👑 <b>Admin Panel</b>\n\n"
-            f"🤖 <b>Bot Status:</b> Active\n"
+            f"🤖 <b>Bot Status:</b> {self._bot_status()}\n"
             f"📧 <b>Gmail monitoring:</b> Enabled\n"
             f"⏱️ <b>Check interval:</b> {self.config.check_interval}s\n"
             f"💬 <b>Target chats:</b> {len(self.config.telegram_chat_ids)}\n"
@@ -134,110 +267,493 @@ class TelegramService:
             f"<b>Admin Commands:</b>\n"
             f"/admin - This admin panel\n"
             f"/chats - View all configured chats\n"
-            f"/status - Bot status (available to all)\n\n"
+            f"/reload - Reload configuration from {html.escape(self.config.config_file)}\n"
+            f"/quota - Gmail API quota usage\n"
+            f"/stats - Delivery statistics\n"
+            f"/recent - Recent bot activity\n"
+            f"/timings - Per-stage check timings\n"
+            f"/profile [seconds] - Capture a cProfile/tracemalloc report\n"
+            f"/status - Bot status (available to all)\n"
+            f"/check - Check Gmail now (all configured chats)\n\n"
             f"<b>Your Chat ID:</b> <code>{message.chat.id}</code>"
         )
 
         await message.answer(admin_text, parse_mode='HTML')
 
-    async def send_verification_message(self, messages: List[Dict]):
+    async def reload_command(self, message: Message):
+        """Handle /reload command - reload configuration (admin only)"""
+        if not self.is_admin(str(message.chat.id)):
+            await message.answer(
+                "❌ You're not authorized to use this command. "
+                "This command is only available to administrators."
+            )
+            return
+
+        if not self.config_watcher:
+            await message.answer("⚠️ Configuration reload is not available.")
+            return
+
+        try:
+            new_config = await self.config_watcher.reload()
+        except Exception as e:
+            logger.error(f"Configuration reload failed: {e}")
+            await message.answer(f"❌ Configuration reload failed: {e}")
+            return
+
+        if new_config is None:
+            await message.answer("ℹ️ Configuration unchanged.")
+        else:
+            await message.answer(
+                "✅ Configuration reloaded\n\n"
+                f"⏱️ Check interval: {new_config.check_interval}s\n"
+                f"💬 Target chats: {len(new_config.telegram_chat_ids)}\n"
+                f"👑 Admin chats: {len(new_config.telegram_admin_ids)}\n"
+                f"🔍 Keywords: {len(new_config.verification_keywords)} configured"
+            )
+
+    async def quota_command(self, message: Message):
+        """Handle /quota command - show Gmail API quota usage (admin only)"""
+        if not self.is_admin(str(message.chat.id)):
+            await message.answer(
+                "❌ You're not authorized to use this command. "
+                "This command is only available to administrators."
+            )
+            return
+
+        if not self.gmail_service:
+            await message.answer("⚠️ Gmail quota information is not available.")
+            return
+
+        quota = self.gmail_service.quota.snapshot()
+        breaker = self.gmail_service.circuit_breaker
+        calls_text = '\n'.join(
+            f"• {method}: {count} calls, {quota['units'][method]} units"
+            for method, count in sorted(quota['calls'].items())
+        ) or "• No calls yet"
+
+        breaker_text = breaker.state
+        if breaker.state == breaker.OPEN:
+            breaker_text += f" (retry in {breaker.seconds_until_retry():.0f}s)"
+
+        quota_text = (
+            "📊 <b>Gmail API Quota</b>\n\n"
+            f"🔥 <b>Burn rate:</b> {quota['burn_rate']:.2f} units/s "
+            f"(last {self.gmail_service.quota.report_window:.0f}s)\n"
+            f"🚧 <b>Throttle limit:</b> {quota['limit']} units/s\n"
+            f"⏳ <b>Time throttled:</b> {quota['throttled_seconds']:.1f}s\n"
+            f"🔌 <b>Circuit breaker:</b> {breaker_text}, "
+            f"{breaker.failures} failures\n\n"
+            f"<b>Usage since start:</b> {quota['total_units']} units\n"
+            f"{calls_text}"
+        )
+        await message.answer(quota_text, parse_mode='HTML')
+
+    async def stats_command(self, message: Message):
+        """Handle /stats command - show delivery statistics (admin only)"""
+        if not self.is_admin(str(message.chat.id)):
+            await message.answer(
+                "❌ You're not authorized to use this command. "
+                "This command is only available to administrators."
+            )
+            return
+
+        summary = self.stats.summary()
+        totals = summary['totals']
+        since_poll = summary['seconds_since_poll']
+        stats_text = (
+            "📈 <b>Bot Statistics</b>\n\n"
+            f"🤖 <b>Status:</b> {self._bot_status()}\n"
+            f"⏳ <b>Uptime:</b> {summary['uptime'] / 3600:.1f}h\n"
+            f"🕐 <b>Last successful check:</b> "
+            f"{f'{since_poll:.0f}s ago' if since_poll is not None else 'never'}\n\n"
+            f"<b>Since start:</b>\n"
+            f"• Checks: {totals['poll']} ok, {totals['poll_failed']} failed, "
+            f"slowest {summary['max_poll_latency']:.2f}s\n"
+            f"• Codes found: {totals['codes']}\n"
+            f"• Deliveries: {totals['delivery']} ok, "
+            f"{totals['delivery_failed']} failed\n"
+            f"• Messages updated in place: {totals['edit']}\n"
+            f"• Commands: {self.throttle.allowed} handled, "
+            f"{self.throttle.throttled} throttled "
+            f"({self.throttle.warned} warnings, "
+            f"{self.throttle.tracked_users} users tracked)\n\n"
+            f"<b>Last {summary['window_events']} events "
+            f"({summary['window_seconds'] / 60:.0f} min):</b>\n"
+            f"• Codes: {summary['codes_per_minute']:.2f}/min\n"
+            f"• Deliveries: {summary['deliveries_per_minute']:.2f}/min\n"
+            f"• Check time: {summary['avg_poll_latency']:.2f}s avg\n"
+            f"• Send time: {summary['avg_delivery_latency'] * 1000:.0f}ms avg\n"
+            f"• Email-to-Telegram lag: {summary['avg_code_lag']:.0f}s avg"
+        )
+        await message.answer(stats_text, parse_mode='HTML')
+
+    async def recent_command(self, message: Message):
+        """Handle /recent command - show recent bot activity (admin only)"""
+        if not self.is_admin(str(message.chat.id)):
+            await message.answer(
+                "❌ You're not authorized to use this command. "
+                "This command is only available to administrators."
+            )
+            return
+
+        records = self.stats.recent(15)
+        if not records:
+            await message.answer("📭 No activity recorded yet.")
+            return
+
+        lines = []
+        for record in records:
+            time_str = datetime.fromtimestamp(
+                record.timestamp, timezone.utc
+            ).strftime('%H:%M:%S')
+            detail = f" {html.escape(record.detail)}" if record.detail else ""
+            lines.append(
+                f"<code>{time_str}</code> {record.kind} ×{record.count} "
+                f"{record.latency:.2f}s{detail}"
+            )
+
+        await message.answer(
+            "🕘 <b>Recent Activity</b> (UTC)\n\n" + '\n'.join(lines),
+            parse_mode='HTML'
+        )
+
+    async def timings_command(self, message: Message):
+        """Handle /timings command - show sampled stage timings (admin only)"""
+        if not self.is_admin(str(message.chat.id)):
+            await message.answer(
+                "❌ You're not authorized to use this command. "
+                "This command is only available to administrators."
+            )
+            return
+
+        if not self.profiler:
+            await message.answer("⚠️ Stage timings are not available.")
+            return
+
+        await message.answer(
+            "⏱️ <b>Check Stage Timings</b>\n\n"
+            f"<pre>{html.escape(self.profiler.format_timings())}</pre>",
+            parse_mode='HTML'
+        )
+
+    async def profile_command(self, message: Message, command: CommandObject):
+        """Handle /profile command - capture a profile report (admin only)"""
+        if not self.is_admin(str(message.chat.id)):
+            await message.answer(
+                "❌ You're not authorized to use this command. "
+                "This command is only available to administrators."
+            )
+            return
+
+        if not self.profiler:
+            await message.answer("⚠️ Profiling is not available.")
+            return
+
+        seconds = self.config.profile_seconds
+        if command.args:
+            try:
+                seconds = int(command.args.strip())
+            except ValueError:
+                await message.answer("Usage: /profile [seconds]")
+                return
+        seconds = max(1, min(seconds, MAX_PROFILE_SECONDS))
+
+        if self.profiler.capturing:
+            await message.answer("⚠️ A profile capture is already running.")
+            return
+
+        await message.answer(
+            f"🔬 Profiling for {seconds}s, a Gmail check will run meanwhile..."
+        )
+        report = await self.profiler.capture(seconds, workload=self.poll_trigger)
+        await message.answer_document(
+            BufferedInputFile(report.encode(), filename=self._profile_filename()),
+            caption=f"📊 {seconds}s cProfile and tracemalloc report"
+        )
+
+    def _profile_filename(self) -> str:
+        """File name for a profile report"""
+        return f"profile-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.txt"
+
+    def _chat_format(self, chat_id: str) -> str:
+        """Get the message variant configured for a chat"""
+        return self.config.telegram_chat_formats.get(
+            chat_id, self.config.telegram_message_format
+        )
+
+    def _group_chats_by_format(self, chat_ids: List[str]) -> Dict[str, List[str]]:
+        """Group chats by message variant so each variant renders once"""
+        groups: Dict[str, List[str]] = {}
+        for chat_id in chat_ids:
+            groups.setdefault(self._chat_format(chat_id), []).append(chat_id)
+        return groups
+
+    async def _send_rendered(self, chat_id: str,
+                             rendered: RenderedMessage) -> Optional[Message]:
+        """Send a pre-rendered message to a chat"""
+        start = time.perf_counter()
+        try:
+            with span('telegram.send'):
+                sent = await self.bot.send_message(
+                    chat_id=chat_id,
+                    text=rendered.text,
+                    parse_mode=rendered.parse_mode
+                )
+            self.stats.record(
+                DELIVERY, latency=time.perf_counter() - start, detail=chat_id
+            )
+            return sent
+        except Exception as e:
+            logger.error(f"Error sending message to chat {chat_id}: {e}")
+            self.stats.record(
+                DELIVERY_FAILED, latency=time.perf_counter() - start,
+                detail=chat_id
+            )
+            return None
+
+    async def _edit_rendered(self, chat_id: str, message_id: int,
+                             rendered: RenderedMessage) -> bool:
+        """Replace the text of a message sent earlier"""
+        start = time.perf_counter()
+        try:
+            with span('telegram.edit'):
+                await self.bot.edit_message_text(
+                    text=rendered.text,
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    parse_mode=rendered.parse_mode
+                )
+        except TelegramBadRequest as e:
+            if 'message is not modified' not in str(e):
+                # Deleted, too old to edit, etc.: send a new message instead
+                logger.warning(
+                    f"Can't edit message {message_id} in chat {chat_id}: {e}"
+                )
+                return False
+        except Exception as e:
+            logger.error(
+                f"Error editing message {message_id} in chat {chat_id}: {e}"
+            )
+            return False
+
+        self.stats.record(
+            EDIT, latency=time.perf_counter() - start, detail=chat_id
+        )
+        return True
+
+    async def _deliver_to_chat(self, msg: VerificationMessage, chat_id: str,
+                               fmt: str, rendered: RenderedMessage,
+                               expired_cache: Dict) -> str:
+        """Edit the sender's recent message in a chat, or send a new one.
+
+        Returns SENT, SKIPPED for a code older than one already delivered,
+        or FAILED.
+        """
+        if self.config.code_edit_window <= 0:
+            sent = await self._send_rendered(chat_id, rendered)
+            return FAILED if sent is None else SENT
+
+        previous = self.delivery_store.get(msg.sender, chat_id)
+        if previous and msg.date < previous.date:
+            # Gmail lists newest first, so an older email from the same
+            # sender can arrive after its replacement: its codes are stale
+            return SKIPPED
+        if previous:
+            expired = []
+            variant = rendered
+            if self.config.mark_expired_codes:
+                expired = previous.replaced_codes(msg.codes)
+                key = (fmt, tuple(expired))
+                if expired and key not in expired_cache:
+                    expired_cache[key] = self.formatter.render(msg, fmt, expired)
+                variant = expired_cache.get(key, rendered)
+
+            if await self._edit_rendered(chat_id, previous.message_id, variant):
+                logger.info(
+                    f"Updated message {previous.message_id} in chat {chat_id} "
+                    f"with a newer code from {msg.sender}"
+                )
+                self.delivery_store.put(
+                    msg.sender, chat_id, previous.message_id, msg.date,
+                    msg.codes, expired
+                )
+                return SENT
+
+        sent = await self._send_rendered(chat_id, rendered)
+        if sent is None:
+            return FAILED
+        self.delivery_store.put(
+            msg.sender, chat_id, sent.message_id, msg.date, msg.codes
+        )
+        return SENT
+
+    async def send_verification_message(self, messages: List[VerificationMessage]):
         """Send verification code messages to all target chats"""
-        for msg_data in messages:
-            # Format the message
-            text = self._format_verification_message(msg_data)
-
-            # Send to all configured chats
-            for chat_id in self.config.telegram_chat_ids:
-                try:
-                    await self.bot.send_message(
-                        chat_id=chat_id,
-                        text=text,
-                        parse_mode='HTML'
-                    )
-                    logger.info(
-                        f"Sent verification message to chat {chat_id} "
-                        f"from {msg_data['sender']}"
-                    )
+        if self.config.message_coalescing:
+            await self._queue_coalesced(messages)
+            return
+
+        for msg in messages:
+            await self.deliver_message(msg, self.render_message(msg))
+
+    def render_message(self, msg: VerificationMessage) -> Dict[str, RenderedMessage]:
+        """Render a message once per variant used by the target chats"""
+        with span('telegram.render'):
+            return self.formatter.render_variants(
+                msg, self._group_chats_by_format(self.config.telegram_chat_ids)
+            )
 
-                except Exception as e:
-                    logger.error(
-                        f"Error sending message to chat {chat_id}: {e}"
+    async def deliver_message(self, msg: VerificationMessage,
+                              rendered: Dict[str, RenderedMessage]):
+        """Send a rendered message to all target chats"""
+        chat_groups = self._group_chats_by_format(self.config.telegram_chat_ids)
+        total = len(self.config.telegram_chat_ids)
+        done = 0
+        # Variants with expired codes, shared by chats that had the same codes
+        expired_cache = {}
+        self.pending_sends += total
+        try:
+            for fmt, chat_ids in chat_groups.items():
+                # Formats may have changed since rendering on a config reload
+                variant = rendered.get(fmt) or self.formatter.render(msg, fmt)
+                for chat_id in chat_ids:
+                    status = await self._deliver_to_chat(
+                        msg, chat_id, fmt, variant, expired_cache
                     )
-                    # Try sending without HTML formatting as fallback
-                    try:
-                        plain_text = self._format_plain_message(msg_data)
-                        await self.bot.send_message(
-                            chat_id=chat_id,
-                            text=plain_text
-                        )
+                    done += 1
+                    self.pending_sends -= 1
+                    if status == SKIPPED:
                         logger.info(
-                            f"Sent plain text message to chat {chat_id} "
-                            f"as fallback"
+                            f"Skipped older code from {msg.sender} in chat "
+                            f"{chat_id}, a newer one was already delivered"
                         )
-                    except Exception as fallback_error:
-                        logger.error(
-                            f"Fallback message also failed for chat {chat_id}: "
-                            f"{fallback_error}"
+                        # Nothing was sent, so no pacing either
+                        continue
+                    if status == SENT:
+                        logger.info(
+                            f"Delivered verification message to chat {chat_id} "
+                            f"from {msg.sender}"
                         )
+                    # Small delay between messages to avoid rate limiting
+                    with span('telegram.pacing'):
+                        await asyncio.sleep(0.1)
+        finally:
+            self.pending_sends -= total - done
+
+    @property
+    def coalesce_backlog(self) -> int:
+        """Number of messages waiting for the coalescing window"""
+        return len(self._coalesce_buffer)
+
+    async def _queue_coalesced(self, messages: List[VerificationMessage]):
+        """Send now, or buffer until the coalescing window closes"""
+        if self.config.coalesce_window <= 0:
+            await self._send_coalesced(messages)
+            return
 
-                # Small delay between messages to avoid rate limiting
-                await asyncio.sleep(0.1)
+        self._coalesce_buffer.extend(messages)
+        if not self._coalesce_task or self._coalesce_task.done():
+            self._coalesce_task = asyncio.create_task(
+                self._flush_coalesced_after(self.config.coalesce_window)
+            )
+
+    async def _flush_coalesced_after(self, delay: float):
+        """Flush the coalescing buffer after a delay"""
+        await asyncio.sleep(delay)
+        await self.flush_coalesced()
+
+    async def flush_coalesced(self):
+        """Send everything waiting in the coalescing buffer"""
+        messages, self._coalesce_buffer = self._coalesce_buffer, []
+        if messages:
+            await self._send_coalesced(messages)
+
+    async def _send_coalesced(self, messages: List[VerificationMessage]):
+        """Send all messages as one combined message per chat"""
+        chat_groups = self._group_chats_by_format(self.config.telegram_chat_ids)
+        with span('telegram.render'):
+            batches = {
+                fmt: self.formatter.render_batch(messages, fmt)
+                for fmt in chat_groups
+            }
+        total = sum(
+            len(batches[fmt]) * len(chat_ids)
+            for fmt, chat_ids in chat_groups.items()
+        )
+        done = 0
+        self.pending_sends += total
+        try:
+            for fmt, chat_ids in chat_groups.items():
+                chunks = batches[fmt]
+                for chat_id in chat_ids:
+                    for chunk in chunks:
+                        await self._send_rendered(chat_id, chunk)
+                        done += 1
+                        self.pending_sends -= 1
+                        # Small delay between messages to avoid rate limiting
+                        with span('telegram.pacing'):
+                            await asyncio.sleep(0.1)
+                    logger.info(
+                        f"Sent {len(messages)} coalesced verification messages "
+                        f"to chat {chat_id} in {len(chunks)} message(s)"
+                    )
+        finally:
+            self.pending_sends -= total - done
 
-    async def send_to_specific_chats(self, messages: List[Dict],
+    async def send_to_specific_chats(self, messages: List[VerificationMessage],
                                      chat_ids: List[str]):
         """Send verification code messages to specific chat IDs"""
-        for msg_data in messages:
-            text = self._format_verification_message(msg_data)
-
-            for chat_id in chat_ids:
-                # Only send to configured chats
-                if chat_id in self.config.telegram_chat_ids:
-                    try:
-                        await self.bot.send_message(
-                            chat_id=chat_id,
-                            text=text,
-                            parse_mode='HTML'
-                        )
+        # Only send to configured chats
+        chat_groups = self._group_chats_by_format([
+            chat_id for chat_id in chat_ids
+            if self.is_authorized_chat(chat_id)
+        ])
+        for msg in messages:
+            rendered = self.formatter.render_variants(msg, chat_groups)
+
+            for fmt, fmt_chat_ids in chat_groups.items():
+                for chat_id in fmt_chat_ids:
+                    if await self._send_rendered(chat_id, rendered[fmt]):
                         logger.info(
                             f"Sent verification message to specific "
                             f"chat {chat_id}"
                         )
-                    except Exception as e:
-                        logger.error(
-                            f"Error sending message to chat {chat_id}: {e}"
-                        )
 
                     await asyncio.sleep(0.1)
 
+    def _render_text(self, text: str) -> RenderedMessage:
+        """Use HTML parse mode only if Telegram will accept the markup"""
+        if validate_html(text):
+            return RenderedMessage(text, 'HTML')
+        logger.warning("Message is not valid Telegram HTML, sending as plain text")
+        return RenderedMessage(text, None)
+
     async def send_admin_message(self, text: str):
         """Send message to all admin chats"""
         if not self.config.telegram_admin_ids:
             logger.warning("No admin IDs configured for admin messages")
             return
 
+        rendered = self._render_text(text)
+        for admin_id in self.config.telegram_admin_ids:
+            if await self._send_rendered(admin_id, rendered):
+                logger.info(f"Sent admin message to {admin_id}")
+
+            await asyncio.sleep(0.1)
+
+    async def send_admin_report(self, report: str, caption: str):
+        """Send a text report as a file to all admin chats"""
+        document = BufferedInputFile(
+            report.encode(), filename=self._profile_filename()
+        )
         for admin_id in self.config.telegram_admin_ids:
             try:
-                await self.bot.send_message(
-                    chat_id=admin_id,
-                    text=text,
-                    parse_mode='HTML'
+                await self.bot.send_document(
+                    admin_id, document, caption=caption
                 )
-                logger.info(f"Sent admin message to {admin_id}")
+                logger.info(f"Sent report to admin {admin_id}")
             except Exception as e:
-                logger.error(f"Error sending admin message to {admin_id}: {e}")
-                # Try without HTML formatting as fallback
-                try:
-                    await self.bot.send_message(
-                        chat_id=admin_id,
-                        text=text
-                    )
-                    logger.info(f"Sent plain text admin message to {admin_id}")
-                except Exception as fallback_error:
-                    logger.error(
-                        f"Fallback admin message failed for {admin_id}: "
-                        f"{fallback_error}"
-                    )
-
+                logger.error(f"Error sending report to admin {admin_id}: {e}")
             await asyncio.sleep(0.1)
 
     async def send_status_message(self, text: str):
@@ -246,99 +762,92 @@ class TelegramService:
 
     async def broadcast_message(self, text: str):
         """Broadcast a message to all configured chats"""
+        rendered = self._render_text(text)
         for chat_id in self.config.telegram_chat_ids:
-            try:
-                await self.bot.send_message(
-                    chat_id=chat_id,
-                    text=text,
-                    parse_mode='HTML'
-                )
+            if await self._send_rendered(chat_id, rendered):
                 logger.info(f"Broadcasted message to chat {chat_id}")
-            except Exception as e:
-                logger.error(f"Error broadcasting to chat {chat_id}: {e}")
-                # Try without HTML formatting as fallback
-                try:
-                    await self.bot.send_message(
-                        chat_id=chat_id,
-                        text=text
-                    )
-                    logger.info(f"Sent plain text broadcast to chat {chat_id}")
-                except Exception as fallback_error:
-                    logger.error(
-                        f"Fallback broadcast failed for chat {chat_id}: "
-                        f"{fallback_error}"
-                    )
 
             await asyncio.sleep(0.1)
 
-    def _format_plain_message(self, msg_data: Dict) -> str:
-        """Format verification message as plain text (fallback)"""
-        codes_text = ""
-        if msg_data['codes']:
-            codes_text = f"\n\nCodes found: {' | '.join(msg_data['codes'])}"
-
-        # Format datetime with timezone awareness
-        msg_date = msg_data['date']
-        if msg_date.tzinfo is None:
-            msg_date = msg_date.replace(tzinfo=timezone.utc)
-
-        time_str = msg_date.strftime('%H:%M:%S UTC')
+    async def prepare(self):
+        """Open the bot session and verify the token before first use"""
+        try:
+            me = await self.bot.get_me()
+            self.is_ready = True
+            logger.info(f"Telegram bot ready: @{me.username}")
+        except Exception as e:
+            logger.error(f"Error preparing Telegram bot: {e}")
 
-        text = (
-            f"📧 Verification Email Received\n\n"
-            f"Subject: {msg_data['subject']}\n"
-            f"Time: {time_str}"
-            f"{codes_text}"
-        )
+    def setup_webhook(self, app: web.Application):
+        """Register the webhook handler on the shared HTTP server app"""
+        from aiogram.webhook.aiohttp_server import SimpleRequestHandler
 
-        return text
+        SimpleRequestHandler(
+            dispatcher=self.dp,
+            bot=self.bot,
+            secret_token=self.config.telegram_webhook_secret
+        ).register(app, path=self.config.telegram_webhook_path)
 
-    def _format_verification_message(self, msg_data: Dict) -> str:
-        """Format verification message for Telegram"""
-        codes_text = ""
-        if msg_data['codes']:
-            codes_text = (
-                f"\n\n🔢 <b>Codes found:</b> "
-                f"<code>{' | '.join(msg_data['codes'])}</code>"
+    async def start_webhook(self):
+        """Point Telegram at the webhook and serve updates until closed"""
+        self._webhook_stopped = asyncio.Event()
+        try:
+            logger.info(
+                f"Setting Telegram webhook to {self.config.telegram_webhook_url}"
             )
-
-        # Format datetime with timezone awareness
-        msg_date = msg_data['date']
-        if msg_date.tzinfo is None:
-            msg_date = msg_date.replace(tzinfo=timezone.utc)
-
-        time_str = msg_date.strftime('%H:%M:%S UTC')
-
-        # Escape HTML entities to prevent parsing errors
-        subject = html.escape(msg_data['subject'])
-
-        text = (
-            f"📧 <b>Verification Email Received</b>\n\n"
-            f"📋 <b>Subject:</b> {subject}\n"
-            f"🕐 <b>Time:</b> {time_str}"
-            f"{codes_text}"
-        )
-
-        return text
+            await self.bot.set_webhook(
+                url=self.config.telegram_webhook_url,
+                secret_token=self.config.telegram_webhook_secret,
+                allowed_updates=self.dp.resolve_used_update_types()
+            )
+            await self.dp.emit_startup(bot=self.bot)
+            # Updates arrive through the HTTP server until we're stopped
+            await self._webhook_stopped.wait()
+        except Exception as e:
+            logger.error(f"Error in bot webhook: {e}")
+        finally:
+            self.is_ready = False
+            await self.dp.emit_shutdown(bot=self.bot)
 
     async def start_polling(self):
         """Start the bot polling"""
         try:
             logger.info("Starting Telegram bot polling...")
-            await self.dp.start_polling(self.bot)
+            # A webhook left over from webhook mode makes getUpdates fail
+            try:
+                await self.bot.delete_webhook()
+            except Exception as e:
+                logger.warning(f"Could not delete Telegram webhook: {e}")
+            # The bot handles SIGTERM/SIGINT itself to shut down gracefully
+            await self.dp.start_polling(self.bot, handle_signals=False)
         except Exception as e:
             logger.error(f"Error in bot polling: {e}")
         finally:
+            self.is_ready = False
             await self.bot.session.close()
 
+    async def stop_updates(self):
+        """Stop receiving updates so no new commands start during shutdown"""
+        if self._webhook_stopped:
+            self._webhook_stopped.set()
+            return
+        try:
+            await self.dp.stop_polling()
+        except RuntimeError:
+            # Polling never started or has already stopped
+            pass
+
     async def close(self):
         """Close bot session"""
+        self.is_ready = False
+        if self._webhook_stopped:
+            self._webhook_stopped.set()
         await self.bot.session.close()
 
     def is_authorized_chat(self, chat_id: str) -> bool:
         """Check if chat ID is in the authorized list"""
-        return chat_id in self.config.telegram_chat_ids
+        return chat_id in self.roles.chats
 
     def is_admin(self, chat_id: str) -> bool:
         """Check if chat ID is in the admin list"""
-        return chat_id in self.config.telegram_admin_ids
+        return chat_id in self.roles.admins